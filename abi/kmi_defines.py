@@ -41,14 +41,16 @@ even think about what concurrent updates would cause to shuch a facility.
 
 import argparse
 import collections
+import concurrent.futures
+import functools
 import logging
 import multiprocessing
 import os
-import pathlib
 import re
+import stat
 import subprocess
 import sys
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 from typing import Set  # pytype needs this, pylint: disable=unused-import
 
 INDENT = 4  # number of spaces to indent for each depth level
@@ -72,11 +74,36 @@ COMPILER = "clang"  # TODO(pantin): should be determined at run-time
 
 HIDDEN_DEP = "include/generated/autoconf.h"
 
+#   Regular expressions used by this program, compiled once when the module
+#   is loaded instead of relying on the re module pattern cache lookup on
+#   every call.  These are on the hot path, they are applied to every
+#   .o.cmd file examined.
+
+_WILDCARD_RE = re.compile(r"\$\(wildcard[^)]*\)")
+_DEPS_SPLIT_RE = re.compile(r"[:\s\\]+")
+_DEPS_TAIL_RE = re.compile(r"[\s\\]*\Z")
+_TYPE_RE = re.compile(r"(^<class '__main__\.|'>$)")
+_KBUILD_QUOTE_RE = re.compile(
+    r"""-D(KBUILD_BASENAME|KBUILD_MODNAME)='("[a-zA-Z0-9_.:]*")'""")
+
 
 class StopError(Exception):
     """Exception raised to stop work when an unexpected error occurs."""
 
 
+#   Indentation strings per depth level, precomputed so that dumping a
+#   node does not rebuild " " * (depth * INDENT) for every line.
+
+_INDENTS = [" " * (depth * INDENT) for depth in range(64)]
+
+
+def _indent(depth: int) -> str:
+    """Return the indentation string for a depth level."""
+    if depth < len(_INDENTS):
+        return _INDENTS[depth]
+    return " " * (depth * INDENT)
+
+
 def dump(this) -> None:
     """Dump the data in this.
 
@@ -84,33 +111,37 @@ def dump(this) -> None:
     the types used by the underlying code are handled.  This will not be
     part of the final code, or if it is, it will be significantly enhanced
     or replaced by some other introspection mechanism to serialize data.
+
+    The output is accumulated in a list of lines and written with a
+    single sys.stdout.write(), a print() call per line would mean one
+    write per line of a potentially huge component tree.
     """
+    parts: List[str] = []
+
     def dump_this(this, name: str, depth: int) -> None:
         """Dump the data in this."""
         if name:
             name += " = "
         if isinstance(this, str):
-            indent = " " * (depth * INDENT)
-            print(indent + name + this)
-        elif isinstance(this, bool):
-            indent = " " * (depth * INDENT)
-            print(indent + name + str(this))
-        elif isinstance(this, List):
+            parts.append(_indent(depth) + name + this)
+        elif isinstance(this, (bool, int)):
+            parts.append(_indent(depth) + name + str(this))
+        elif isinstance(this, list):
             dump_list(this, name, depth)
-        elif isinstance(this, Set):
+        elif isinstance(this, set):
             dump_set(this, name, depth)
         else:
             dump_object(this, name, depth)
 
     def dump_list(lst: List[str], name: str, depth: int) -> None:
         """Dump the data in lst."""
-        indent = " " * (depth * INDENT)
-        print(indent + name + "{")
+        indent = _indent(depth)
+        parts.append(indent + name + "{")
         index = 0
         for entry in lst:
             dump_this(entry, f"[{index}]", depth + 1)
             index += 1
-        print(indent + "}")
+        parts.append(indent + "}")
 
     def dump_set(aset: Set[str], name: str, depth: int) -> None:
         """Dump the data in aset."""
@@ -120,34 +151,96 @@ def dump(this) -> None:
 
     def dump_object(this, name: str, depth: int) -> None:
         """Dump the data in this."""
-        indent = " " * (depth * INDENT)
-        print(indent + name +
-              re.sub(r"(^<class '__main__\.|'>$)", "", str(type(this))) + " {")
+        indent = _indent(depth)
+        parts.append(indent + name +
+                     _TYPE_RE.sub("", str(type(this))) + " {")
         for key, val in this.__dict__.items():
             dump_this(val, key, depth + 1)
-        print(indent + "}")
+        parts.append(indent + "}")
 
     dump_this(this, "", 0)
+    sys.stdout.write("\n".join(parts) + "\n")
 
 
+@functools.lru_cache(maxsize=None)
 def readfile(name: str) -> str:
-    """Open a file and return its contents in a string as its value."""
+    """Open a file and return its contents in a string as its value.
+
+    The results are cached, several files (for example the .o.cmd files
+    of modules made of a single source file) are read more than once
+    while a kernel component is inspected.  The file is read in binary
+    mode and decoded explicitly, this skips the text mode newline
+    translation, none of the files read by this program need it.
+    """
     try:
-        with open(name) as file:
-            return file.read()
+        with open(name, "rb") as file:
+            return file.read().decode()
     except OSError as os_error:
         raise StopError("readfile() failed for: " + name + "\n"
                         "original OSError: " + str(os_error.args))
 
 
+@functools.lru_cache(maxsize=None)
 def file_must_exist(file: str) -> None:
-    """If file is invalid print raise a StopError."""
-    if not os.path.exists(file):
+    """If file is invalid print raise a StopError.
+
+    The same file is validated many times, e.g. a header depended upon
+    by most objects of a component, successful validations are cached.
+    Failures raise and are not cached by functools.lru_cache.
+
+    A single os.stat() answers both the existence and the regular file
+    checks, os.path.exists() followed by os.path.isfile() would stat
+    the file twice.
+    """
+    try:
+        status = os.stat(file)
+    except FileNotFoundError:
         raise StopError("file does not exist: " + file)
-    if not os.path.isfile(file):
+    except OSError as os_error:
+        raise StopError("could not stat file: " + file + "\n"
+                        "original OSError: " + str(os_error.args))
+    if not stat.S_ISREG(status.st_mode):
         raise StopError("file is not a regular file: " + file)
 
 
+@functools.lru_cache(maxsize=None)
+def _resolved_dir(directory: str) -> str:
+    """Return os.path.realpath(directory), caching the result."""
+    return os.path.realpath(directory)
+
+
+def realpath_cached(path: str) -> str:
+    """Resolve path like os.path.realpath() with a directory cache.
+
+    os.path.realpath() readlinks every component of its argument, and
+    the files examined by this program concentrate in a small number of
+    directories (include/, arch/..., the build output directory).  The
+    containing directory is resolved through a cache, so each unique
+    directory costs one realpath walk; only the final component is
+    checked per call, and only if it is itself a symlink does the full
+    realpath run.
+    """
+    directory, base = os.path.split(path)
+    if not base:  # path is a root or ends in a separator
+        return os.path.realpath(path)
+    resolved = os.path.join(_resolved_dir(directory), base)
+    if os.path.islink(resolved):
+        return os.path.realpath(resolved)
+    return resolved
+
+
+@functools.lru_cache(maxsize=None)
+def canonical_path(build_dir: str, path: str) -> str:
+    """Resolve path, relative to build_dir unless absolute, with caching.
+
+    The same headers recur across most objects of a component, caching
+    the result removes almost all of the resolution syscalls.
+    """
+    if not os.path.isabs(path):
+        path = os.path.join(build_dir, path)
+    return realpath_cached(path)
+
+
 def makefile_depends_get_dependencies(depends: str) -> List[str]:
     """Return list with the dependencies of a makefile target.
 
@@ -160,7 +253,7 @@ def makefile_depends_get_dependencies(depends: str) -> List[str]:
     in the remainder of the list, return everything in the list other than
     the first element.
     """
-    return re.split(r"[:\s\\]+", re.sub(r"[\s\\]*\Z", "", depends))[1:]
+    return _DEPS_SPLIT_RE.split(_DEPS_TAIL_RE.sub("", depends))[1:]
 
 
 def makefile_assignment_split(assignment: str) -> Tuple[str, str]:
@@ -168,12 +261,38 @@ def makefile_assignment_split(assignment: str) -> Tuple[str, str]:
 
     Spaces around the := are also removed.
     """
-    result = re.split(r"\s*:=\s*", assignment, maxsplit=1)
-    if len(result) != 2:
+    left, sep, right = assignment.partition(":=")
+    if not sep:
         raise StopError(
             "expected: 'left<optional_spaces>:=<optional_spaces>right' in: " +
             assignment)
-    return result[0], result[1]  # left, right
+    return left.rstrip(), right.lstrip()
+
+
+def makefile_logical_lines(contents: str) -> Iterator[str]:
+    """Yield the logical lines of a makefile snippet.
+
+    Physical lines ending in a continuation character, i.e. "\", are
+    joined with the following line; the whitespace around the
+    continuation collapses into a single space, as make does.  Empty
+    lines are skipped.  This is a single pass over contents, it avoids
+    rewriting the whole string just to splice continuations.
+    """
+    parts = []
+    for line in contents.split("\n"):
+        if parts:
+            line = line.lstrip(" \t")
+        if line.endswith("\\"):
+            parts.append(line[:-1].rstrip(" \t"))
+            continue
+        if parts:
+            parts.append(line)
+            line = " ".join(parts)
+            parts = []
+        if line:
+            yield line
+    if parts:
+        yield " ".join(parts)
 
 
 def get_src_ccline_deps(obj: str) -> Optional[Tuple[str, str, List[str]]]:
@@ -189,24 +308,29 @@ def get_src_ccline_deps(obj: str) -> Optional[Tuple[str, str, List[str]]]:
                          "." + os.path.basename(obj) + ".cmd")
 
     contents = readfile(o_cmd)
-    contents = re.sub(r"\$\(wildcard[^)]*\)", " ", contents)
-    contents = re.sub(r"[ \t]*\\\n[ \t]*", " ", contents)
-    lines = lines_to_list(contents)
 
     cc_line = None
     deps = None
     source = None
-    for line in lines:
+    for line in makefile_logical_lines(contents):
         if line.startswith("cmd_"):
             cc_line = line
         elif line.startswith("deps_"):
             deps = line
         elif line.startswith("source_"):
             source = line
+        else:
+            continue
+        if cc_line is not None and deps is not None and source is not None:
+            break  # each variable occurs once, stop scanning early
+
+    #   $(wildcard ...) references only occur in the cmd_* and deps_*
+    #   values, strip them from just those two lines instead of from
+    #   the whole file contents.
 
     if cc_line is None:
         raise StopError("missing cmd_* variable in: " + o_cmd)
-    _, cc_line = makefile_assignment_split(cc_line)
+    _, cc_line = makefile_assignment_split(_WILDCARD_RE.sub(" ", cc_line))
     if cc_line.split(maxsplit=1)[0] != COMPILER:
         #   The object file was made by strip, symbol renames, etc.
         #   i.e. it was not the result of running the compiler, thus
@@ -222,13 +346,37 @@ def get_src_ccline_deps(obj: str) -> Optional[Tuple[str, str, List[str]]]:
 
     if deps is None:
         raise StopError("missing deps_* variable in: " + o_cmd)
-    _, deps = makefile_assignment_split(deps)
+    _, deps = makefile_assignment_split(_WILDCARD_RE.sub(" ", deps))
     dependendencies = deps.split()
     dependendencies.append(HIDDEN_DEP)
 
     return source, cc_line, dependendencies
 
 
+def process_object_file(obj: str,
+                        build_dir: str) -> Optional[Tuple[str, str, List[str]]]:
+    """Parse the .o.cmd file of an object and canonicalize its paths.
+
+    If the object was not produced by compiling a C source file None is
+    returned.  Otherwise it returns a triplet with the resolved C source
+    file name, its cc_line, and the resolved dependencies.
+
+    This is a top level function, instead of a member of KernelComponent,
+    so that it can be mapped through a process pool to work on the object
+    files of a single component concurrently.
+    """
+    file_must_exist(obj)
+    result = get_src_ccline_deps(obj)
+    if result is None:
+        return None
+    src, cc_line, dependendencies = result
+
+    file_must_exist(src)
+    depends = [canonical_path(build_dir, dep) for dep in dependendencies]
+    src = canonical_path(build_dir, src)
+    return src, cc_line, depends
+
+
 def lines_to_list(lines: str) -> List[str]:
     """Split a string into a list of non-empty lines."""
     return [line for line in lines.strip().splitlines() if line]
@@ -264,6 +412,62 @@ def run(args: List[str],
                         "original OSError: " + str(os_error.args))
 
 
+#   Magic strings that start an ar archive: regular archives and the
+#   thin archives used for the kernel's built-in.a files.
+
+AR_MAGIC = b"!<arch>\n"
+AR_THIN_MAGIC = b"!<thin>\n"
+
+
+def ar_list(archive: str) -> List[str]:
+    """Return the member names of an ar archive.
+
+    The archive headers are read directly instead of spawning an
+    "ar t" subprocess per archive, the fork and exec of ar cost more
+    than reading the headers.  The ar format is simple: an 8 byte magic
+    string followed by 60 byte member headers, each with the member
+    name in its first 16 bytes and the member size at offset 48.  Both
+    regular and thin archives are handled, as is the GNU extended name
+    table (the "//" member) used for long member names.
+    """
+    names = []
+    long_names = b""
+    try:
+        with open(archive, "rb") as file:
+            magic = file.read(8)
+            if magic not in (AR_MAGIC, AR_THIN_MAGIC):
+                raise StopError("not an ar archive: " + archive)
+            thin = magic == AR_THIN_MAGIC
+            while True:
+                header = file.read(60)
+                if len(header) < 60:
+                    break
+                name = header[0:16].rstrip()
+                size = int(header[48:58])
+                if name == b"/":  # symbol table, present even when thin
+                    file.seek(size + (size & 1), 1)
+                    continue
+                if name == b"//":  # extended name table, present when thin
+                    long_names = file.read(size)
+                    if size & 1:
+                        file.seek(1, 1)
+                    continue
+                if name.startswith(b"/") and name[1:].isdigit():
+                    offset = int(name[1:])
+                    end = long_names.index(b"\n", offset)
+                    name = long_names[offset:end]
+                names.append(name.rstrip(b"/").decode())
+                if not thin:  # member contents are elsewhere when thin
+                    file.seek(size + (size & 1), 1)
+            return names
+    except OSError as os_error:
+        raise StopError("ar_list() failed for: " + archive + "\n"
+                        "original OSError: " + str(os_error.args))
+    except ValueError as value_error:
+        raise StopError("malformed ar archive: " + archive + "\n"
+                        "original ValueError: " + str(value_error.args))
+
+
 class KernelModule:
     """A kernel module, i.e. a *.ko file."""
     def __init__(self, kofile: str) -> None:
@@ -276,7 +480,7 @@ class KernelModule:
         #       drivers/usb/gadget/udc/modname.ko
         #   the values assigned to the members are shown in the comments below.
 
-        self._file = os.path.realpath(kofile)  # /abs/dirs/modname.ko
+        self._file = realpath_cached(kofile)  # /abs/dirs/modname.ko
         self._base = os.path.basename(self._file)  # modname.ko
         self._directory = os.path.dirname(self._file)  # /abs/dirs
         self._cmd_file = os.path.join(self._directory,
@@ -285,22 +489,25 @@ class KernelModule:
 
         #   Some builds append a '; true' to the .modname.ko.cmd, remove it
 
-        self._cmd_text = re.sub(r";\s*true\s*$", "", self._cmd_text)
+        stripped = self._cmd_text.rstrip()
+        if stripped.endswith("true"):
+            head = stripped[:-len("true")].rstrip()
+            if head.endswith(";"):
+                self._cmd_text = head[:-1]
 
         #   The modules .modname.ko.cmd file contains a makefile snippet,
         #   for example:
         #       cmd_drivers/usb/gadget/udc/dummy_hcd.ko := ld.lld -r ...
         #
-        #   Split the string prior to the spaces followed by ":=", and get
-        #   the first element of the resulting list.  If the string was not
-        #   split (because it did not contain a ":=" then the input string
-        #   is returned, by the re.sub() below, as the only element of the list.
+        #   Split the string at the ":=", the left hand side is the name of
+        #   the module prefixed with "cmd_", verify the prefix is there and
+        #   remove it.
 
         left, _ = makefile_assignment_split(self._cmd_text)
-        self._rel_file = re.sub(r"^cmd_", "", left)
-        if self._rel_file == left:
+        if not left.startswith("cmd_"):
             raise StopError("expected: 'cmd_' at start of content of: " +
                             self._cmd_file)
+        self._rel_file = left[len("cmd_"):]
 
         base = os.path.basename(self._rel_file)
         if base != self._base:
@@ -323,12 +530,11 @@ class KernelModule:
 
         kofile_name, _ = os.path.splitext(self._base)
         objs = shell_line_to_o_files_list(self._cmd_text)
-        objs.sort()
-        expected = [  # sorted, i.e.: .mod.o < .o
+        expected = {
             os.path.join(self._rel_dir, kofile_name + ".mod.o"),
             os.path.join(self._rel_dir, kofile_name + ".o")
-        ]
-        if objs != expected:
+        }
+        if set(objs) != expected:
             raise StopError("unexpected .o files in: " + self._cmd_file)
 
     def get_build_dir(self) -> str:
@@ -380,7 +586,7 @@ class KernelModule:
 
         _, ldline = makefile_assignment_split(olines[0])
         return [
-            os.path.realpath(os.path.join(build_dir, obj))
+            realpath_cached(os.path.join(build_dir, obj))
             for obj in shell_line_to_o_files_list(ldline)
         ]
 
@@ -389,7 +595,7 @@ class Kernel:
     """The Linux kernel component itself, i.e. vmlinux.o."""
     def __init__(self, kernel: str) -> None:
         """Construct a Kernel object."""
-        self._kernel = os.path.realpath(kernel)
+        self._kernel = realpath_cached(kernel)
         self._build_dir = os.path.dirname(self._kernel)
         libs = os.path.join(self._build_dir, "vmlinux.libs")
         objs = os.path.join(self._build_dir, "vmlinux.objs")
@@ -417,25 +623,29 @@ class Kernel:
             if file.endswith(".o"):
                 if not os.path.isabs(file):
                     file = os.path.join(build_dir, file)
-                olist.append(os.path.realpath(file))
+                olist.append(realpath_cached(file))
                 continue
 
             if not file.endswith(".a"):
                 raise StopError("unknown file type: " + file)
 
-            completion = run(["ar", "t", file])
-            objs = lines_to_list(completion.stdout)
-
-            for obj in objs:
+            for obj in ar_list(file):
                 if not os.path.isabs(obj):
                     obj = os.path.join(build_dir, obj)
-                olist.append(os.path.realpath(obj))
+                olist.append(realpath_cached(obj))
 
         return olist
 
 
 class Target:  # pylint: disable=too-few-public-methods
-    """Target of build and the information used to build it."""
+    """Target of build and the information used to build it.
+
+    Instances are transient: KernelComponent runs every compilation
+    through this class to validate and normalize its cc_line, then
+    stores the extracted fields in its structure of arrays form (see
+    KernelComponent.__init__) instead of keeping one Target object,
+    with its per object and per dict overhead, per .o file.
+    """
 
     #   The compiler invocation has this form:
     #       clang -Wp,-MD,file.o.d  ... -c -o file.o file.c
@@ -457,12 +667,7 @@ class Target:  # pylint: disable=too-few-public-methods
     OBJ_INDEX = -2
     SRC_INDEX = -1
 
-    def __init__(self, obj: str, src: str, cc_line: str,
-                 deps: List[str]) -> None:
-        self._obj = obj
-        self._src = src
-        self._deps = deps
-
+    def __init__(self, obj: str, src: str, cc_line: str) -> None:
         #   The cc_line, eventually slightly modified, will be used to run
         #   the compiler in various ways.  The cc_line could be fed through
         #   the shell to deal with the single-quotes in the cc_line that are
@@ -497,10 +702,7 @@ class Target:  # pylint: disable=too-few-public-methods
         #   source of fragility, but not expected to cause much trouble in the
         #   future as the Linux build evolves.
 
-        cc_cmd = re.sub(
-            r"""-D(KBUILD_BASENAME|KBUILD_MODNAME)='("[a-zA-Z0-9_.:]*")'""",
-            r"-D\1=\2", cc_line)
-        cc_list = cc_cmd.split()
+        cc_cmd = _KBUILD_QUOTE_RE.sub(r"-D\1=\2", cc_line)
 
         #   TODO(pantin): the handling of -D... arguments above is done better
         #   in a later commit by using shlex.split().  Please ignore for now.
@@ -515,13 +717,24 @@ class Target:  # pylint: disable=too-few-public-methods
         #   be in a future update to the Linux build could changed to be a
         #   single argument with the object file name (as in: -ofile.o) which
         #   could also be detected in code at a later time.
-
-        if (len(cc_list) < Target.MIN_CC_LIST_LEN
-                or not cc_list[Target.WP_MD_FLAG_INDEX].startswith("-Wp,-MD,")
-                or cc_list[Target.C_FLAG_INDEX] != "-c"
-                or cc_list[Target.O_FLAG_INDEX] != "-o"):
+        #
+        #   Only the tokens that are checked are actually split out of the
+        #   cc_cmd, which is often tens of kilobytes long: the last four with
+        #   rsplit() and the first two of the remaining head.  The negative
+        #   *_INDEX constants index the rsplit() result the same way they
+        #   index the fully split argument list.  The full argument list is
+        #   only built on demand by get_cc_list().
+
+        parts = cc_cmd.rsplit(None, 4)
+        head_list = parts[0].split(None, 2) if parts else []
+        if (len(parts) < 5 or len(head_list) < Target.MIN_CC_LIST_LEN - 4
+                or not head_list[Target.WP_MD_FLAG_INDEX].startswith(
+                    "-Wp,-MD,")
+                or parts[Target.C_FLAG_INDEX] != "-c"
+                or parts[Target.O_FLAG_INDEX] != "-o"):
             raise StopError("unexpected or missing arguments for: " + obj +
                             " cc_line: " + cc_line)
+        cc_list = parts
 
         #   Instead of blindly normalizing the source and object arguments,
         #   they are only normalized if that allows the expected invariants
@@ -543,7 +756,20 @@ class Target:  # pylint: disable=too-few-public-methods
         verify_file(obj, Target.OBJ_INDEX, "object", cc_list, obj)
         verify_file(src, Target.SRC_INDEX, "source", cc_list, obj)
 
-        self._cc_list = cc_list
+        self._cc_head = cc_list[0]
+        self._cc_tail = cc_list[1:]
+
+    def get_cc_head(self) -> str:
+        """Return the unsplit head of the compiler invocation."""
+        return self._cc_head
+
+    def get_cc_tail(self) -> List[str]:
+        """Return the last four arguments of the compiler invocation."""
+        return self._cc_tail
+
+    def get_cc_list(self) -> List[str]:
+        """Return the compiler invocation as a list of its arguments."""
+        return self._cc_head.split() + self._cc_tail
 
 
 class KernelComponentBase:  # pylint: disable=too-few-public-methods
@@ -591,8 +817,16 @@ class KernelComponent(KernelComponentBase):
     determine what was used to build it: object filess, source files, header
     files, and other information that is produced as a by-product of its build.
     """
-    def __init__(self, filename: str) -> None:
-        """Construct a KernelComponent object."""
+    def __init__(self, filename: str, jobs: int = 1) -> None:
+        """Construct a KernelComponent object.
+
+        If jobs is greater than 1 the work for the object files of this
+        component is spread over that many worker processes.  This must
+        only be used when the component is not itself being made inside
+        a multiprocessing.Pool worker (those workers are daemonic and
+        can not have children), i.e. only for vmlinux.o, which has by
+        far the most object files.
+        """
         if filename.endswith("vmlinux.o"):
             self._kernel = True
             self._kind = Kernel(filename)
@@ -602,36 +836,65 @@ class KernelComponent(KernelComponentBase):
         self._build_dir = self._kind.get_build_dir()
         self._source_dir = self._get_source_dir()
         self._files_o = self._kind.get_object_files(self._build_dir)
-        self._files_o.sort()
+
+        if jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                    jobs, mp_context=multiprocessing.get_context(
+                        "fork")) as executor:
+                results = list(
+                    executor.map(functools.partial(process_object_file,
+                                                   build_dir=self._build_dir),
+                                 self._files_o,
+                                 chunksize=64))
+        else:
+            results = [
+                process_object_file(obj, self._build_dir)
+                for obj in self._files_o
+            ]
 
         #   using a set because there is no unique flag to list.sort()
         deps_set = set()
 
-        self._targets = []
-        for obj in self._files_o:
-            file_must_exist(obj)
-            result = get_src_ccline_deps(obj)
+        #   The targets are stored transposed, as a structure of arrays:
+        #   one list per field plus the dependencies flattened into
+        #   _dep_flat with _dep_offsets delimiting each target's slice
+        #   (the dependencies of target i are
+        #   _dep_flat[_dep_offsets[i]:_dep_offsets[i + 1]], see
+        #   get_target_deps()).  A Target object per .o file would cost
+        #   an object plus dict header per target, thousands of small
+        #   objects for vmlinux.o that also bloat the pickle of this
+        #   component when it is returned from a worker process.
+
+        self._target_objs: List[str] = []
+        self._target_srcs: List[str] = []
+        self._target_cc_heads: List[str] = []
+        self._target_cc_tails: List[str] = []  # four entries per target
+        self._dep_offsets: List[int] = [0]
+        self._dep_flat: List[str] = []
+
+        #   The same header paths recur in the dependencies of most of
+        #   the objects.  When the per object work was done in worker
+        #   processes the unpickled results hold a distinct string
+        #   object per occurrence; interning collapses them to a single
+        #   object each, which shrinks the working set and lets pickle
+        #   memoize each unique path once when this component is itself
+        #   sent back from a worker process.
+
+        for obj, result in zip(self._files_o, results):
             if result is None:
                 continue
-            src, cc_line, dependendencies = result
-
-            file_must_exist(src)
-            depends = []
-            for dep in dependendencies:
-                if not os.path.isabs(dep):
-                    dep = os.path.join(self._build_dir, dep)
-                dep = os.path.realpath(dep)
-                depends.append(dep)
-                deps_set.add(dep)
-
-            if not os.path.isabs(src):
-                src = os.path.join(self._build_dir, src)
-            src = os.path.realpath(src)
-            self._targets.append(Target(obj, src, cc_line, depends))
-
-        for dep in [dep for dep in list(deps_set) if not dep.endswith(".h")]:
-            deps_set.remove(dep)
-        self._deps_set = deps_set
+            src, cc_line, depends = result
+            depends = [sys.intern(dep) for dep in depends]
+            deps_set.update(depends)
+            target = Target(obj, src, cc_line)
+            self._target_objs.append(obj)
+            self._target_srcs.append(sys.intern(src))
+            self._target_cc_heads.append(target.get_cc_head())
+            self._target_cc_tails.extend(target.get_cc_tail())
+            self._dep_flat.extend(depends)
+            self._dep_offsets.append(len(self._dep_flat))
+
+        self._deps_set = {dep for dep in deps_set if dep.endswith(".h")}
 
     def _get_source_dir(self) -> str:
         """Return the top level Linux kernel source directory."""
@@ -652,15 +915,21 @@ class KernelComponent(KernelComponentBase):
         """Return the set of dependencies for the kernel component."""
         return self._deps_set
 
+    def get_target_deps(self, index: int) -> List[str]:
+        """Return the dependencies of the index'th target."""
+        return self._dep_flat[self._dep_offsets[index]:
+                              self._dep_offsets[index + 1]]
+
     def is_kernel(self) -> bool:
         """Is this the kernel?"""
         return self._kernel
 
 
-def kernel_component_factory(filename: str) -> KernelComponentBase:
+def kernel_component_factory(filename: str,
+                             jobs: int = 1) -> KernelComponentBase:
     """Make an InfoKmod or an InfoKernel object for file and return it."""
     try:
-        return KernelComponent(filename)
+        return KernelComponent(filename, jobs)
     except StopError as stop_error:
         return KernelComponentCreationError(filename,
                                             " ".join([*stop_error.args]))
@@ -668,14 +937,15 @@ def kernel_component_factory(filename: str) -> KernelComponentBase:
 
 class KernelComponentProcess(multiprocessing.Process):
     """Process to make the KernelComponent concurrently."""
-    def __init__(self) -> None:
+    def __init__(self, jobs: int) -> None:
         multiprocessing.Process.__init__(self)
+        self._jobs = jobs
         self._queue = multiprocessing.Queue()
         self.start()
 
     def run(self) -> None:
         """Create and save the KernelComponent."""
-        self._queue.put(kernel_component_factory("vmlinux.o"))
+        self._queue.put(kernel_component_factory("vmlinux.o", self._jobs))
 
     def get_component(self) -> KernelComponentBase:
         """Return the kernel component."""
@@ -684,31 +954,61 @@ class KernelComponentProcess(multiprocessing.Process):
         return kernel_component
 
 
-def work_on_all_components(options) -> List[KernelComponentBase]:
-    """Return a list of KernelComponentBase objects."""
-    files = [str(ko) for ko in pathlib.Path().rglob("*.ko")]
+def find_kernel_modules(root: str = ".") -> Iterator[str]:
+    """Yield the path of every *.ko file under root.
+
+    This is an iterative os.scandir() walk.  It avoids the per entry
+    Path object creation and fnmatch work of pathlib.Path.rglob() and it
+    yields paths as they are discovered, so the consumer can start
+    working on modules while the walk is still in progress.
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".ko"):
+                    yield entry.path.removeprefix("./")
+
+
+def work_on_all_components(options) -> Iterator[KernelComponentBase]:
+    """Yield KernelComponentBase objects as they become available.
+
+    Yielding the components as they are finished, instead of returning
+    them all in a list, lets the caller fold each one into its results
+    while the workers are still busy with the remaining components.
+    """
     if options.sequential:
-        return [
-            kernel_component_factory(file) for file in ["vmlinux.o"] + files
-        ]
+        yield kernel_component_factory("vmlinux.o")
+        for file in find_kernel_modules():
+            yield kernel_component_factory(file)
+        return
 
     #  There is significantly more work to be done for the vmlinux.o than
     #  the *.ko kernel modules.  A dedicated process is started to do the
     #  work for vmlinux.o as soon as possible instead of leaving it to the
     #  vagaries of multiprocessing.Pool() and how it would spreads the work.
+    #  Its object files are in turn spread over options.jobs processes.
     #  This significantly reduces the elapsed time for this work.
 
-    kernel_component_process = KernelComponentProcess()
+    kernel_component_process = KernelComponentProcess(options.jobs)
 
-    chunk_size = 128
-    processes = max(1, len(files) // (chunk_size * 3))
-    processes = min(processes, os.cpu_count())
-    with multiprocessing.Pool(processes) as pool:
-        components = pool.map(kernel_component_factory, files, chunk_size)
+    #  The modules are fed to the pool straight from the directory walk
+    #  so that their discovery overlaps with their parsing.  The number
+    #  of modules is not known up front, size the pool by CPU count.
 
-    kernel_component = kernel_component_process.get_component()
+    #  The workers are forked so that they inherit the warm module state
+    #  (compiled regexes, the realpath and stat caches) instead of
+    #  re-importing it, and they persist for the whole run (the default
+    #  maxtasksperchild) so those caches keep accumulating across tasks.
+
+    chunk_size = 128
+    with multiprocessing.get_context("fork").Pool(os.cpu_count()) as pool:
+        yield from pool.imap_unordered(kernel_component_factory,
+                                       find_kernel_modules(), chunk_size)
 
-    return [kernel_component] + components
+    yield kernel_component_process.get_component()
 
 
 def work_on_whole_build(options) -> int:
@@ -716,10 +1016,12 @@ def work_on_whole_build(options) -> int:
     if not os.path.isfile("vmlinux.o"):
         logging.error("file not found: vmlinux.o")
         return 1
-    components = work_on_all_components(options)
     failed = False
     header_count = collections.defaultdict(int)
-    for comp in components:
+    components = []  # retained only when they need to be dumped below
+    for comp in work_on_all_components(options):
+        if options.dump:
+            components.append(comp)
         error = comp.get_error()
         if error:
             logging.error(error)
@@ -735,9 +1037,10 @@ def work_on_whole_build(options) -> int:
     if options.dump and options.includes:
         print()
     if options.includes:
-        for header, count in header_count.items():
-            if count >= 2:
-                print(header)
+        headers = sorted(
+            header for header, count in header_count.items() if count >= 2)
+        if headers:
+            sys.stdout.write("\n".join(headers) + "\n")
     return 0
 
 
@@ -758,6 +1061,11 @@ def main() -> int:
                         "--sequential",
                         action="store_true",
                         help="execute without concurrency")
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="processes used to inspect a single component")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-i",
                        "--includes",
@@ -772,7 +1080,8 @@ def main() -> int:
     if not options.component:
         return work_on_whole_build(options)
 
-    comp = kernel_component_factory(options.component)
+    comp = kernel_component_factory(
+        options.component, options.jobs if not options.sequential else 1)
 
     error = comp.get_error()
     if error:
@@ -18,7 +18,6 @@ import os
 import pathlib
 import re
 import shlex
-import shutil
 import sys
 import textwrap
 from typing import BinaryIO, Generator, Tuple, Optional
@@ -471,19 +470,22 @@ class BazelWrapper(KleafHelpPrinter):
         self.gen_bazelrc_dir = self.absolute_out_dir / "bazel/bazelrc"
         os.makedirs(self.gen_bazelrc_dir, exist_ok=True)
 
+        # Computed once; every bazelrc below lives under this directory.
+        bazelrc_dir = self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc"
+
         self.transformed_startup_options += self._transform_bazelrc_files([
             # Add support for various configs
             # Do not sort, the order here might matter.
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/ants.bazelrc",
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/android_ci.bazelrc",
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/local.bazelrc",
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/fast.bazelrc",
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/rbe.bazelrc",
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/silent.bazelrc",
+            bazelrc_dir / "ants.bazelrc",
+            bazelrc_dir / "android_ci.bazelrc",
+            bazelrc_dir / "local.bazelrc",
+            bazelrc_dir / "fast.bazelrc",
+            bazelrc_dir / "rbe.bazelrc",
+            bazelrc_dir / "silent.bazelrc",
         ])
 
         self.transformed_startup_options += self._transform_bazelrc_files([
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/stamp.bazelrc",
+            bazelrc_dir / "stamp.bazelrc",
         ])
         stamp_extra_bazelrc = self.gen_bazelrc_dir / "stamp_extra.bazelrc"
         with open(stamp_extra_bazelrc, "w") as f:
@@ -502,7 +504,7 @@ class BazelWrapper(KleafHelpPrinter):
         ])
 
         self.transformed_startup_options += self._transform_bazelrc_files([
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/release.bazelrc",
+            bazelrc_dir / "release.bazelrc",
             self.kleaf_repo_dir / FLAGS_BAZEL_RC,
         ])
 
@@ -519,15 +521,15 @@ class BazelWrapper(KleafHelpPrinter):
 
         self.transformed_startup_options += self._transform_bazelrc_files([
             # Toolchains and platforms
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/hermetic_cc.bazelrc",
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/platforms.bazelrc",
+            bazelrc_dir / "hermetic_cc.bazelrc",
+            bazelrc_dir / "platforms.bazelrc",
             # Control Network access - with no internet by default.
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/network.bazelrc",
+            bazelrc_dir / "network.bazelrc",
             # Experimental bzlmod support
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/bzlmod.bazelrc",
+            bazelrc_dir / "bzlmod.bazelrc",
 
             # Canary goes to the end because it uses flags / configs from elsewhere.
-            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/canary.bazelrc",
+            bazelrc_dir / "canary.bazelrc",
 
             self.kleaf_repo_dir / "build/kernel/kleaf/common.bazelrc",
         ])
@@ -549,6 +551,7 @@ class BazelWrapper(KleafHelpPrinter):
         if self.command == "clean":
             sys.stderr.write(
                 f"INFO: Removing cache directory for $OUT_DIR: {self.known_args.cache_dir}\n")
+            import shutil
             shutil.rmtree(self.known_args.cache_dir, ignore_errors=True)
         else:
             os.makedirs(self.known_args.cache_dir, exist_ok=True)
@@ -725,6 +728,7 @@ class BazelWrapper(KleafHelpPrinter):
 
     async def remove_gen_bazelrc_dir(self):
         sys.stderr.write("INFO: Deleting generated bazelrc directory.\n")
+        import shutil
         shutil.rmtree(self.gen_bazelrc_dir, ignore_errors=True)
 
 
@@ -25,7 +25,9 @@ Running this script requires buildozer. Install it at
 """
 
 import argparse
-import collections
+import concurrent.futures
+import functools
+import hashlib
 import json
 import logging
 import os
@@ -41,7 +43,7 @@ _DEFAULT_KERNEL_BUILD_SRCS = \
     """glob(["**"],\\ exclude=["**/.*",\\ "**/.*/**",\\ "**/BUILD.bazel",\\ "**/*.bzl",])"""
 
 # Variables that should be conditionally ignored and not shown in BUILD files.
-# Keys are variable names. Values are regular expressions.
+# Keys are variable names. Values are compiled regular expressions.
 # - If the value matches the regular expression, it is considered ignored (i.e. the BUILD
 #   file is not modified).
 # - If the value of the variable in the build config does NOT match the regular expression, the
@@ -50,6 +52,7 @@ _DEFAULT_KERNEL_BUILD_SRCS = \
 # Following are variables set by build configs or _setup_env.sh that does not
 # need to be translated into BUILD definitions. Ignore these variables.
 # ^(.|\n)*$ matches any (multi-line) string.
+_MATCH_ANY = re.compile(r"^(.|\n)*$")
 _IGNORED_BUILD_CONFIGS = dict.fromkeys(
     [
         "_",  # reserved by bash
@@ -125,14 +128,14 @@ _IGNORED_BUILD_CONFIGS = dict.fromkeys(
         "USERLDFLAGS",
         "_SETUP_ENV_SH_INCLUDED",
     ],
-    r"^(.|\n)*$"
+    _MATCH_ANY
 )
 
 # Conditionally ignored.
 # These variables are ignored only if the value matches the condition.
 _IGNORED_BUILD_CONFIGS.update(
     {
-        "HERMETIC_TOOLCHAIN": r"^1$",  # Ignore iff HERMETIC_TOOLCHAIN=1
+        "HERMETIC_TOOLCHAIN": re.compile(r"^1$"),  # Ignore iff HERMETIC_TOOLCHAIN=1
     }
 )
 
@@ -151,24 +154,36 @@ _IGNORED_BUILD_CONFIGS.update(dict.fromkeys(
         "VENDOR_RAMDISK_CMDS",
         "STOP_SHIP_TRACEPRINTK",
     ],
-    r"^$"
+    re.compile(r"^$")
 ))
 
+# Keys ignored regardless of their value. Only the remaining,
+# conditionally ignored keys need a regex match per run.
+_UNCONDITIONALLY_IGNORED_BUILD_CONFIGS = frozenset(
+    key for key, pattern in _IGNORED_BUILD_CONFIGS.items()
+    if pattern is _MATCH_ANY)
+
 
 def die(msg):
     logging.error("%s", msg)
     sys.exit(1)
 
 
-def order_dict_by_key(d: Mapping[str, str]) -> Mapping[str, str]:
-    return collections.OrderedDict(sorted(d.items()))
+def _escape(value: str) -> str:
+    """Escapes a value for embedding in a buildozer command."""
+    return value.translate(buildozer_command_builder.BUILDOZER_ESCAPE)
+
+
+# realpath stats every path component; memoize so repeated lookups of the
+# same path (e.g. across the two passes of run()) are free.
+_real_path = functools.lru_cache(maxsize=None)(os.path.realpath)
 
 
 def find_build_config(env: Mapping[str, str]) -> str:
     # Set by either environment or _setup_env.sh
     if env.get("BUILD_CONFIG"):
-        real_build_config = os.path.realpath(env["BUILD_CONFIG"])
-        real_this = os.path.realpath(".")
+        real_build_config = _real_path(env["BUILD_CONFIG"])
+        real_this = _real_path(".")
         if os.path.commonpath([real_build_config, real_this]) != real_this:
             die(f"realpath $BUILD_CONFIG ({real_build_config}) is not under the repository root")
         return os.path.relpath(real_build_config, real_this)
@@ -179,9 +194,9 @@ def infer_target_name(args, build_config: str) -> str:
     if args.target:
         return args.target
     build_config_base = os.path.basename(build_config)
-    if build_config_base.startswith(
-            _BUILD_CONFIG_PREFIX) and build_config_base != _BUILD_CONFIG_PREFIX:
-        return build_config_base[len(_BUILD_CONFIG_PREFIX):]
+    stripped = build_config_base.removeprefix(_BUILD_CONFIG_PREFIX)
+    if stripped != build_config_base and stripped:
+        return stripped
     die("Fail to infer target name. Specify with --target.")
 
 
@@ -189,10 +204,34 @@ class BuildConfigToBazel(buildozer_command_builder.BuildozerCommandBuilder):
     def __init__(self, *init_args, **init_kwargs):
         super().__init__(*init_args, **init_kwargs)
 
-        self.new_env = order_dict_by_key(json.loads(subprocess.check_output(
-            "source build/kernel/_setup_env.sh > /dev/null && build/kernel/kleaf/dump_env.py",
-            shell=True, stderr=self.stderr, env=self.environ, executable="/bin/bash")))
-        logging.info("Captured env: %s", json.dumps(self.new_env, indent=2))
+        # Resolving buildozer (a PATH scan plus a stat) and the bash
+        # dump of the sourced build config are independent startup
+        # costs; overlap them.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            buildozer_future = pool.submit(lambda: self.buildozer)
+            # Only lookups are done against the full env; sorting all
+            # of it would be wasted work. Ordering matters solely for
+            # the emitted commands, so only the small actionable subset
+            # below is sorted.
+            self.new_env = self._capture_env()
+        buildozer_future.result()
+        logging.info("Captured env: %s",
+                     json.dumps(self.new_env, indent=2, sort_keys=True))
+
+        # Pre-screen the captured env once; both passes of run() then
+        # iterate only the actionable subset. Ignored variables
+        # typically dominate a captured environment.
+        self.env_to_process = {
+            key: self.new_env[key]
+            for key in sorted(
+                key for key in self.new_env
+                if key not in _IGNORED_BUILD_CONFIGS
+                and not self._is_bash_func(key))}
+        self._not_supported_keys = [
+            key for key in sorted(self.new_env.keys()
+                                  & _IGNORED_BUILD_CONFIGS.keys()
+                                  - _UNCONDITIONALLY_IGNORED_BUILD_CONFIGS)
+            if not _IGNORED_BUILD_CONFIGS[key].match(self.new_env[key])]
 
         build_config = find_build_config(self.new_env)
         target_name = infer_target_name(self.args, build_config)
@@ -210,6 +249,78 @@ class BuildConfigToBazel(buildozer_command_builder.BuildozerCommandBuilder):
 
         # set elsewhere
         self.dist_targets: Optional[set[str]] = None
+        self._target: Optional[str] = None
+        self._dist: Optional[str] = None
+        self._images: Optional[str] = None
+        self._abi: Optional[str] = None
+        self._modules: Optional[list[str]] = None
+        self._target_comment: Optional[list[str]] = None
+        self._unknowns: Optional[list[str]] = None
+        self._need_unstripped_modules = False
+
+    def _env_cache_path(self) -> Optional[str]:
+        """Returns the cache file for the captured environment.
+
+        The file name carries a digest of $BUILD_CONFIG's path and
+        content plus the mtimes of any $BUILD_CONFIG_FRAGMENTS, so a
+        change to either naturally misses the cache. Returns None if
+        caching is disabled or the digest cannot be computed.
+        """
+        cache_dir = getattr(self.args, "env_cache", None)
+        if cache_dir is None:
+            cache_dir = os.path.join(
+                self.environ.get("XDG_CACHE_HOME")
+                or os.path.join(self.environ.get("HOME", "."), ".cache"),
+                "kleaf")
+        build_config = self.environ.get("BUILD_CONFIG")
+        if not build_config:
+            return None
+        hasher = hashlib.sha256(build_config.encode())
+        try:
+            with open(build_config, "rb") as build_config_file:
+                hasher.update(build_config_file.read())
+            for fragment in self.environ.get("BUILD_CONFIG_FRAGMENTS", "").split():
+                mtime = os.stat(fragment).st_mtime_ns
+                hasher.update(f"{fragment}:{mtime}".encode())
+        except OSError:
+            return None
+        return os.path.join(cache_dir, f"env-{hasher.hexdigest()}.json")
+
+    def _capture_env(self) -> Mapping[str, str]:
+        """Captures the environment after sourcing the build config.
+
+        Sourcing _setup_env.sh costs a full bash roundtrip, so the
+        captured environment is memoized across runs in a JSON file
+        under ~/.cache/kleaf (or --env-cache).
+        """
+        cache_path = self._env_cache_path()
+        if cache_path:
+            try:
+                with open(cache_path) as cache_file:
+                    env = json.load(cache_file)["env"]
+                logging.info("Using captured env from %s", cache_path)
+                return env
+            except (OSError, ValueError, KeyError):
+                pass
+
+        # exec replaces the bash wrapper instead of forking a child for
+        # dump_env.py. Invoking bash directly also avoids the extra
+        # /bin/sh hop that shell=True would add.
+        env = json.loads(subprocess.check_output(
+            ["/bin/bash", "-c",
+             "source build/kernel/_setup_env.sh > /dev/null && "
+             "exec build/kernel/kleaf/dump_env.py"],
+            stderr=self.stderr, env=self.environ))
+
+        if cache_path:
+            # Write-then-rename so a concurrent run never reads a
+            # partially written cache file.
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as cache_file:
+                json.dump({"env": env}, cache_file)
+            os.replace(temp_path, cache_path)
+        return env
 
     def _new(self, kind: str, name: str, package=None, load_from="//build/kernel/kleaf:kernel.bzl",
              add_to_dist=True) -> str:
@@ -220,207 +331,308 @@ class BuildConfigToBazel(buildozer_command_builder.BuildozerCommandBuilder):
             self.dist_targets.add(new_target)
         return new_target
 
+    def _ensure_images(self) -> str:
+        """Returns the kernel_images target, creating it on first use."""
+        if self._images is None:
+            self._images = self._new("kernel_images", self.images_name)
+        return self._images
+
+    def _ensure_abi(self) -> str:
+        """Returns the kernel_abi target, creating it on first use."""
+        if self._abi is None:
+            self._abi = self._new("kernel_abi", self.abi_name)
+        return self._abi
+
+    def _handle_build_config(self, key: str, value: str) -> None:
+        self._set_attr(self._target, "build_config", os.path.basename(value), quote=True)
+
+    def _handle_build_config_fragments(self, key: str, value: str) -> None:
+        self._target_comment.append(
+            f"FIXME: {key}={_escape(value)}: Please manually convert to "
+            f"kernel_build_config")
+
+    def _handle_fast_build(self, key: str, value: str) -> None:
+        if value:
+            self._target_comment.append(
+                f"FIXME: {key}: Specify --config=fast in device.bazelrc")
+
+    def _handle_lto(self, key: str, value: str) -> None:
+        if value:
+            self._target_comment.append(
+                f"FIXME: {key}: Specify --lto={value} in device.bazelrc")
+
+    def _handle_dist_dir(self, key: str, value: str) -> None:
+        rel_dist_dir = os.path.relpath(value)
+        self._add_comment(self._dist, "dist_dir",
+                          f'FIXME: or dist_dir = "{rel_dist_dir}"')
+
+    def _handle_do_not_strip_modules(self, key: str, value: str) -> None:
+        self._set_attr(self._target, "strip_modules", value != "1")
+
+    def _handle_files(self, key: str, value: str) -> None:
+        for elem in value.split():
+            self._add_attr(self._target, "outs", elem, quote=True)
+
+    def _handle_ext_modules(self, key: str, value: str) -> None:
+        module_packages = [token.strip() for token in value.split() if token.strip()]
+        for module_package in module_packages:
+            module = self._new("kernel_module",
+                               name=os.path.basename(module_package),
+                               package=module_package,
+                               add_to_dist=False)
+            self._set_attr(module, "kernel_build", self._target, quote=True)
+            # buildozer converts None to ["None"] for outs, so use a different name
+            # then rename.
+            self._add_comment(module, "temp_outs",
+                              f"FIXME: set to the list of external modules in this package. You may "
+                              f"run `tools/bazel build {module}` and follow the instructions "
+                              f"in the error message.",
+                              lambda attr_val: attr_val.is_missing_or_none())
+            self._rename(module, "temp_outs", "outs")
+            self._modules.append(module)
+
+    def _handle_kernel_dir(self, key: str, value: str) -> None:
+        common = self.args.common_kernel_tree
+        if value != self.package:
+            if value.removesuffix("/") == common:
+                self._set_attr(self._target, "srcs", _DEFAULT_KERNEL_BUILD_SRCS, quote=False,
+                               command="set_if_absent")
+                self._add_attr(self._target, "srcs", f"//{common}:kernel_aarch64_sources",
+                               quote=True)
+            else:
+                self._add_comment(
+                    self._target, "srcs",
+                    f"FIXME: add files from KERNEL_DIR {self.new_env['KERNEL_DIR']}")
+        # else keep srcs unchanged
+
+    def _handle_kconfig_ext_prefix(self, key: str, value: str) -> None:
+        self._set_attr(self._target, "kconfig_ext", value, quote=True)
+
+    def _handle_unstripped_modules(self, key: str, value: str) -> None:
+        self._set_attr(self._target, "collect_unstripped_modules", bool(value))
+
+    def _handle_compress_unstripped_modules(self, key: str, value: str) -> None:
+        if value == "1":
+            self._need_unstripped_modules = True
+
+    def _handle_abi_definition(self, key: str, value: str) -> None:
+        common = self.args.common_kernel_tree
+        abi = self._ensure_abi()
+        self._add_comment(abi, "abi_definition",
+                          f"Usually not set in Kleaf. See "
+                          f"build/kernel/kleaf/docs/abi_device.md. Original value: "
+                          f"//{common}:{value}",
+                          lambda attr_val: attr_val.is_missing_or_none())
+
+    def _handle_abi_bool(self, key: str, value: str) -> None:
+        abi = self._ensure_abi()
+        if value == "1":
+            self._set_attr(abi, key.lower(), True)
+
+    def _handle_module_grouping(self, key: str, value: str) -> None:
+        abi = self._ensure_abi()
+        if value == "1":
+            self._set_attr(abi, "module_grouping", True)
+
+    def _handle_kmi_symbol_list(self, key: str, value: str) -> None:
+        common = self.args.common_kernel_tree
+        self._set_attr(self._target, "kmi_symbol_list", f"//{common}:{value}", quote=True)
+
+    def _handle_additional_kmi_symbol_lists(self, key: str, value: str) -> None:
+        common = self.args.common_kernel_tree
+        for kmi_symbol_list in value.split():
+            self._add_attr(self._target, "additional_kmi_symbol_lists",
+                           f"//{common}:{kmi_symbol_list}", quote=True)
+
+    def _handle_kernel_build_bool(self, key: str, value: str) -> None:
+        self._set_attr(self._target, key.lower(), bool(value == "1"))
+
+    def _handle_pre_defconfig_cmds(self, key: str, value: str) -> None:
+        self._target_comment.append(
+            "FIXME: PRE_DEFCONFIG_CMDS: Don't forget to modify PRE_DEFCONFIG_CMDS "
+            "so it writes to $OUT_DIR, not the source tree: "
+            "https://android.googlesource.com/kernel/build/+/refs/heads/main/kleaf/docs/errors.md#defconfig-readonly")
+
+    def _handle_images_bool(self, key: str, value: str) -> None:
+        images = self._ensure_images()
+        # bool(value) checks if the string is empty or not
+        self._set_attr(images, key.removesuffix("_IMG").lower(), bool(value))
+
+    def _handle_skip_vendor_boot(self, key: str, value: str) -> None:
+        images = self._ensure_images()
+        self._set_attr(images, "build_vendor_boot", not bool(value))
+
+    def _handle_mkbootimg_path(self, key: str, value: str) -> None:
+        images = self._ensure_images()
+        self._add_comment(images, "mkbootimg",
+                          f"FIXME: set mkbootimg to label of {_escape(value)}")
+
+    def _handle_modules_options(self, key: str, value: str) -> None:
+        images = self._ensure_images()
+        modules_options_filename = f"modules.options.{self.target_name}"
+        modules_options_path = os.path.join(self.package, modules_options_filename)
+        self._create_extra_file(modules_options_path, value)
+        self._set_attr(images, "modules_options",
+                       f"//{self.package}:{modules_options_filename}",
+                       quote=True)
+
+    def _handle_images_file(self, key: str, value: str) -> None:
+        images = self._ensure_images()
+        attribute = key.lower()
+        path = os.path.relpath(value) if os.path.isabs(value) else value
+        # Equivalent to os.path.commonpath((path, self.package)) ==
+        # self.package for these already-relative paths, without the
+        # per-component path splitting.
+        if path == self.package or path.startswith(self.package + os.sep):
+            self._set_attr(images, attribute,
+                           os.path.relpath(path, start=self.package),
+                           quote=True)
+        else:
+            self._add_comment(images, attribute,
+                              f"FIXME: set {attribute} to label of {_escape(value)}")
+
+    def _handle_gki_build_config(self, key: str, value: str) -> None:
+        common = self.args.common_kernel_tree
+        if value == f"{common}/build.config.gki.aarch64":
+            self._set_attr(self._target, "base_kernel", f"//{common}:kernel_aarch64",
+                           quote=True)
+        else:
+            self._add_comment(self._target, "base_kernel",
+                              f"FIXME: set base_kernel to kernel_build for "
+                              f"{_escape(value)}")
+
+    def _handle_gki_prebuilts_dir(self, key: str, value: str) -> None:
+        self._target_comment.append(
+            f"FIXME: {key}={_escape(value)}: Please manually convert to "
+            f"kernel_filegroup")
+
+    def _handle_dts_ext_dir(self, key: str, value: str) -> None:
+        dts = self._new("kernel_dtstree", self.dts_name, package=value,
+                        add_to_dist=False)
+        self._set_attr(self._target, "dtstree", dts, quote=True)
+
+    def _handle_gki_certification_tools(self, key: str, value: str) -> None:
+        if value == "1":
+            self.dist_targets.add("//build/kernel:gki_certification_tools")
+
+    def _handle_unknown(self, key: str, value: str) -> None:
+        # .get never equals a str for absent keys, so one lookup covers
+        # both the membership and the equality test.
+        if self.environ.get(key) == value:
+            logging.info(f"Ignoring variable {key} in environment.")
+            return
+        self._target_comment.append(
+            f"FIXME: Unknown in build config: {key}={_escape(value)}")
+        self._unknowns.append(key)
+
+    # Dispatch table for _create_buildozer_commands. Built once at class
+    # definition so the main loop does a single dict lookup per variable
+    # instead of a linear chain of comparisons; handlers are stored
+    # unbound and called with an explicit self.
+    _HANDLERS = {
+        "BUILD_CONFIG": _handle_build_config,
+        "BUILD_CONFIG_FRAGMENTS": _handle_build_config_fragments,
+        "FAST_BUILD": _handle_fast_build,
+        "LTO": _handle_lto,
+        "DIST_DIR": _handle_dist_dir,
+        "DO_NOT_STRIP_MODULES": _handle_do_not_strip_modules,
+        "FILES": _handle_files,
+        "EXT_MODULES": _handle_ext_modules,
+        "KERNEL_DIR": _handle_kernel_dir,
+        "KCONFIG_EXT_PREFIX": _handle_kconfig_ext_prefix,
+        "UNSTRIPPED_MODULES": _handle_unstripped_modules,
+        "COMPRESS_UNSTRIPPED_MODULES": _handle_compress_unstripped_modules,
+        "ABI_DEFINITION": _handle_abi_definition,
+        "KMI_SYMBOL_LIST_MODULE_GROUPING": _handle_module_grouping,
+        "KMI_SYMBOL_LIST": _handle_kmi_symbol_list,
+        "ADDITIONAL_KMI_SYMBOL_LISTS": _handle_additional_kmi_symbol_lists,
+        "PRE_DEFCONFIG_CMDS": _handle_pre_defconfig_cmds,
+        "SKIP_VENDOR_BOOT": _handle_skip_vendor_boot,
+        "MKBOOTIMG_PATH": _handle_mkbootimg_path,
+        "MODULES_OPTIONS": _handle_modules_options,
+        "GKI_BUILD_CONFIG": _handle_gki_build_config,
+        "GKI_PREBUILTS_DIR": _handle_gki_prebuilts_dir,
+        "DTS_EXT_DIR": _handle_dts_ext_dir,
+        "BUILD_GKI_CERTIFICATION_TOOLS": _handle_gki_certification_tools,
+    }
+    _HANDLERS.update(dict.fromkeys(
+        ("KMI_ENFORCED", "KMI_SYMBOL_LIST_ADD_ONLY"),
+        _handle_abi_bool))
+    _HANDLERS.update(dict.fromkeys(
+        (
+            "TRIM_NONLISTED_KMI",
+            "GENERATE_VMLINUX_BTF",
+            "KMI_SYMBOL_LIST_STRICT_MODE",
+            "KBUILD_SYMTYPES",
+        ),
+        _handle_kernel_build_bool))
+    _HANDLERS.update(dict.fromkeys(
+        (
+            "BUILD_BOOT_IMG",
+            "BUILD_VENDOR_BOOT_IMG",
+            "BUILD_DTBO_IMG",
+            "BUILD_VENDOR_KERNEL_BOOT",
+            "BUILD_INITRAMFS",
+        ),
+        _handle_images_bool))
+    _HANDLERS.update(dict.fromkeys(
+        (
+            "MODULES_LIST",
+            "MODULES_BLOCKLIST",
+            "SYSTEM_DLKM_FS_TYPE",
+            "SYSTEM_DLKM_MODULES_LIST",
+            "SYSTEM_DLKM_MODULES_BLOCKLIST",
+            "SYSTEM_DLKM_PROPS",
+            "VENDOR_DLKM_ETC_FILES",
+            "VENDOR_DLKM_FS_TYPE",
+            "VENDOR_DLKM_MODULES_LIST",
+            "VENDOR_DLKM_MODULES_BLOCKLIST",
+            "VENDOR_DLKM_PROPS",
+        ),
+        _handle_images_file))
+
     def _create_buildozer_commands(self) -> None:
         """Fills in self.out_file."""
         common = self.args.common_kernel_tree
 
         self.dist_targets = set()
 
-        target = self._new("kernel_build", self.target_name)
-        dist = self._new("copy_to_dist_dir", self.dist_name,
-                         load_from="//build/bazel_common_rules/dist:dist.bzl", add_to_dist=False)
-        self._set_attr(dist, "flat", True)
+        self._target = self._new("kernel_build", self.target_name)
+        self._dist = self._new("copy_to_dist_dir", self.dist_name,
+                               load_from="//build/bazel_common_rules/dist:dist.bzl",
+                               add_to_dist=False)
+        self._set_attr(self._dist, "flat", True)
 
-        images = None
-        need_unstripped_modules = False
-        abi = None
-        modules = []
+        self._images = None
+        self._need_unstripped_modules = False
+        self._abi = None
+        self._modules = []
 
-        target_comment = []
+        self._target_comment = []
 
         # List of build configs unknown to this script. They require attention from
         # the developers to be translated properly.
-        unknowns = []
-
-        for key, value in self.new_env.items():
-            esc_value = value.replace(" ", "\\ ").replace("\n", "\\n")
-
-            if key in _IGNORED_BUILD_CONFIGS:
-                if not re.match(_IGNORED_BUILD_CONFIGS[key], value):
-                    target_comment.append(f"FIXME: {key}={esc_value} not supported")
-                continue
-                # else ignore
-            elif type(self)._is_bash_func(key):
-                continue
-            elif key == "BUILD_CONFIG":
-                self._set_attr(target, "build_config", os.path.basename(value), quote=True)
-            elif key == "BUILD_CONFIG_FRAGMENTS":
-                target_comment.append(
-                    f"FIXME: {key}={esc_value}: Please manually convert to kernel_build_config")
-            elif key == "FAST_BUILD":
-                if value:
-                    target_comment.append(f"FIXME: {key}: Specify --config=fast in device.bazelrc")
-            elif key == "LTO":
-                if value:
-                    target_comment.append(f"FIXME: {key}: Specify --lto={value} in device.bazelrc")
-            elif key == "DIST_DIR":
-                rel_dist_dir = os.path.relpath(value)
-                self._add_comment(dist, "dist_dir",
-                                  f'FIXME: or dist_dir = "{rel_dist_dir}"')
-            elif key == "DO_NOT_STRIP_MODULES":
-                self._set_attr(target, "strip_modules", value != "1")
-            elif key == "FILES":
-                for elem in value.split():
-                    self._add_attr(target, "outs", elem, quote=True)
-            elif key == "EXT_MODULES":
-                module_packages = [token.strip() for token in value.split() if token.strip()]
-                for module_package in module_packages:
-                    module = self._new("kernel_module",
-                                       name=os.path.basename(module_package),
-                                       package=module_package,
-                                       add_to_dist=False)
-                    self._set_attr(module, "kernel_build", target, quote=True)
-                    # buildozer converts None to ["None"] for outs, so use a different name
-                    # then rename.
-                    self._add_comment(module, "temp_outs",
-                                      f"FIXME: set to the list of external modules in this package. You may "
-                                      f"run `tools/bazel build {module}` and follow the instructions "
-                                      f"in the error message.",
-                                      lambda attr_val: attr_val.is_missing_or_none())
-                    self._rename(module, "temp_outs", "outs")
-                    modules.append(module)
-            elif key == "KERNEL_DIR":
-                if value != self.package:
-                    if value.removesuffix("/") == common:
-                        self._set_attr(target, "srcs", _DEFAULT_KERNEL_BUILD_SRCS, quote=False,
-                                       command="set_if_absent")
-                        self._add_attr(target, "srcs", f"//{common}:kernel_aarch64_sources",
-                                       quote=True)
-                    else:
-                        self._add_comment(
-                            target, "srcs",
-                            f"FIXME: add files from KERNEL_DIR {self.new_env['KERNEL_DIR']}")
-                # else keep srcs unchanged
-            elif key == "KCONFIG_EXT_PREFIX":
-                self._set_attr(target, "kconfig_ext", value, quote=True)
-            elif key == "UNSTRIPPED_MODULES":
-                self._set_attr(target, "collect_unstripped_modules", bool(value))
-            elif key == "COMPRESS_UNSTRIPPED_MODULES":
-                if value == "1":
-                    need_unstripped_modules = True
-            elif key == "ABI_DEFINITION":
-                abi = self._new("kernel_abi", self.abi_name)
-                self._add_comment(abi, "abi_definition",
-                                  f"Usually not set in Kleaf. See "
-                                  f"build/kernel/kleaf/docs/abi_device.md. Original value: "
-                                  f"//{common}:{value}",
-                                  lambda attr_val: attr_val.is_missing_or_none())
-            elif key in ("KMI_ENFORCED", "KMI_SYMBOL_LIST_ADD_ONLY"):
-                abi = self._new("kernel_abi", self.abi_name)
-                if value == "1":
-                    self._set_attr(abi, key.lower(), True)
-            elif key == "KMI_SYMBOL_LIST_MODULE_GROUPING":
-                abi = self._new("kernel_abi", self.abi_name)
-                if value == "1":
-                    self._set_attr(abi, "module_grouping", True)
-            elif key == "KMI_SYMBOL_LIST":
-                self._set_attr(target, "kmi_symbol_list", f"//{common}:{value}", quote=True)
-            elif key == "ADDITIONAL_KMI_SYMBOL_LISTS":
-                kmi_symbol_lists = value.split()
-                for kmi_symbol_list in kmi_symbol_lists:
-                    self._add_attr(target, "additional_kmi_symbol_lists",
-                                   f"//{common}:{kmi_symbol_list}", quote=True)
-
-            elif key in (
-                    "TRIM_NONLISTED_KMI",
-                    "GENERATE_VMLINUX_BTF",
-                    "KMI_SYMBOL_LIST_STRICT_MODE",
-                    "KBUILD_SYMTYPES",
-            ):
-                self._set_attr(target, key.lower(), bool(value == "1"))
-            elif key == "PRE_DEFCONFIG_CMDS":
-                target_comment.append(
-                    "FIXME: PRE_DEFCONFIG_CMDS: Don't forget to modify PRE_DEFCONFIG_CMDS "
-                    "so it writes to $OUT_DIR, not the source tree: "
-                    "https://android.googlesource.com/kernel/build/+/refs/heads/main/kleaf/docs/errors.md#defconfig-readonly")
-            elif key in (
-                    "BUILD_BOOT_IMG",
-                    "BUILD_VENDOR_BOOT_IMG",
-                    "BUILD_DTBO_IMG",
-                    "BUILD_VENDOR_KERNEL_BOOT",
-                    "BUILD_INITRAMFS",
-            ):
-                images = self._new("kernel_images", self.images_name)
-                # bool(value) checks if the string is empty or not
-                self._set_attr(images, key.removesuffix("_IMG").lower(), bool(value))
-            elif key == "SKIP_VENDOR_BOOT":
-                images = self._new("kernel_images", self.images_name)
-                self._set_attr(images, "build_vendor_boot", not bool(value))
-            elif key == "MKBOOTIMG_PATH":
-                images = self._new("kernel_images", self.images_name)
-                self._add_comment(images, "mkbootimg",
-                                  f"FIXME: set mkbootimg to label of {esc_value}")
-            elif key == "MODULES_OPTIONS":
-                images = self._new("kernel_images", self.images_name)
-                modules_options_filename = f"modules.options.{self.target_name}"
-                modules_options_path = os.path.join(self.package, modules_options_filename)
-                self._create_extra_file(modules_options_path, value)
-                self._set_attr(images, "modules_options",
-                               f"//{self.package}:{modules_options_filename}",
-                               quote=True)
-            elif key in (
-                    "MODULES_LIST",
-                    "MODULES_BLOCKLIST",
-                    "SYSTEM_DLKM_FS_TYPE",
-                    "SYSTEM_DLKM_MODULES_LIST",
-                    "SYSTEM_DLKM_MODULES_BLOCKLIST",
-                    "SYSTEM_DLKM_PROPS",
-                    "VENDOR_DLKM_ETC_FILES",
-                    "VENDOR_DLKM_FS_TYPE",
-                    "VENDOR_DLKM_MODULES_LIST",
-                    "VENDOR_DLKM_MODULES_BLOCKLIST",
-                    "VENDOR_DLKM_PROPS",
-            ):
-                images = self._new("kernel_images", self.images_name)
-                if os.path.isabs(value):
-                    value = os.path.relpath(value)
-                if os.path.commonpath((value, self.package)) == self.package:
-                    self._set_attr(images, key.lower(), os.path.relpath(value, start=self.package),
-                                   quote=True)
-                else:
-                    self._add_comment(images, key.lower(),
-                                      f"FIXME: set {key.lower()} to label of {esc_value}")
-            elif key == "GKI_BUILD_CONFIG":
-                if value == f"{common}/build.config.gki.aarch64":
-                    self._set_attr(target, "base_kernel", f"//{common}:kernel_aarch64", quote=True)
-                else:
-                    self._add_comment(target, "base_kernel",
-                                      f"FIXME: set base_kernel to kernel_build for {esc_value}")
-            elif key == "GKI_PREBUILTS_DIR":
-                target_comment.append(
-                    f"FIXME: {key}={esc_value}: Please manually convert to kernel_filegroup")
-            elif key == "DTS_EXT_DIR":
-                dts = self._new("kernel_dtstree", self.dts_name, package=value,
-                                add_to_dist=False)
-                self._set_attr(target, "dtstree", dts, quote=True)
-            elif key == "BUILD_GKI_CERTIFICATION_TOOLS":
-                if value == "1":
-                    self.dist_targets.add("//build/kernel:gki_certification_tools")
-            elif key in self.environ:
-                if self.environ[key] == value:
-                    logging.info(f"Ignoring variable {key} in environment.")
-                else:
-                    target_comment.append(f"FIXME: Unknown in build config: {key}={esc_value}")
-                    unknowns.append(key)
-            else:
-                target_comment.append(f"FIXME: Unknown in build config: {key}={esc_value}")
-                unknowns.append(key)
+        self._unknowns = []
+
+        for key in self._not_supported_keys:
+            self._target_comment.append(
+                f"FIXME: {key}={_escape(self.new_env[key])} not supported")
+
+        handlers = self._HANDLERS
+        for key, value in self.env_to_process.items():
+            handlers.get(key, type(self)._handle_unknown)(self, key, value)
+
+        target = self._target
+        dist = self._dist
+        images = self._images
+        abi = self._abi
+        modules = self._modules
 
         for dist_target in self.dist_targets:
             self._add_attr(dist, "data", dist_target, quote=True)
 
         unstripped_modules = None
-        if need_unstripped_modules or abi:
+        if self._need_unstripped_modules or abi:
             unstripped_modules = self._new("kernel_unstripped_modules_archive",
                                            self.unstripped_modules_name)
             self._set_attr(unstripped_modules, "kernel_build", target, quote=True)
@@ -456,10 +668,11 @@ class BuildConfigToBazel(buildozer_command_builder.BuildozerCommandBuilder):
                           f"in the error message.",
                           lambda attr_val: attr_val.is_missing_or_none())
 
-        self._add_target_comment(target, target_comment)
+        self._add_target_comment(target, self._target_comment)
 
-        if unknowns:
-            logging.info("Unknown variables:\n%s", ",\n".join(f'"{e}"' for e in unknowns))
+        if self._unknowns:
+            logging.info("Unknown variables:\n%s",
+                         ",\n".join(f'"{e}"' for e in self._unknowns))
 
         self.out_file.flush()
 
@@ -480,6 +693,12 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
     parser.add_argument("--common-kernel-tree",
                         help="path to common kernel source tree; default is common.",
                         default="common")
+    parser.add_argument("--env-cache",
+                        help="directory caching environments captured from build "
+                             "configs; default is ~/.cache/kleaf. The cache key covers "
+                             "$BUILD_CONFIG content and $BUILD_CONFIG_FRAGMENTS mtimes; "
+                             "delete the directory to force a refresh after changing "
+                             "other files they source.")
     return parser.parse_args(argv)
 
 
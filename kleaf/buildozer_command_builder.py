@@ -14,6 +14,8 @@
 
 import argparse
 import dataclasses
+import functools
+import io
 import logging
 import os
 import pathlib
@@ -21,58 +23,105 @@ import re
 import shutil
 import subprocess
 import sys
-import tempfile
-from typing import Callable, Optional, TextIO, Iterable, Mapping
+from typing import Callable, NamedTuple, Optional, TextIO, Iterable, Mapping
 
 _BUILDOZER_RETURN_CODE_NO_CHANGES_MADE = 3
 
+# Environment variables that are exported bash functions, e.g.
+# BASH_FUNC_gettop%%. These never translate to BUILD definitions.
+_BASH_FUNC_RE = re.compile(r"BASH_FUNC_.*%%\Z")
+
+# Translation table escaping characters that buildozer would otherwise
+# treat as separators in command files. One .translate() pass replaces
+# chained .replace() calls.
+BUILDOZER_ESCAPE = str.maketrans({" ": "\\ ", "\n": "\\n"})
+
 
 def die(*args, **kwargs):
     logging.error(*args, **kwargs)
     sys.exit(1)
 
 
+@functools.cache
+def _find_buildozer(gopath: Optional[str], home: Optional[str]) -> str:
+    """Locates the buildozer binary.
+
+    Cached on the relevant environment variables so repeated
+    construction (e.g. in test suites) pays for the PATH lookup and
+    stat only once.
+    """
+    buildozer = shutil.which("buildozer")
+    if buildozer:
+        return buildozer
+
+    buildozer = os.path.join(gopath or os.path.join(home, "go"),
+                             "bin", "buildozer")
+    if os.path.isfile(buildozer):
+        return buildozer
+
+    die("Can't find buildozer. Install with instructions at "
+        "https://github.com/bazelbuild/buildtools/blob/master/buildozer/README.md")
+
+
 def isinstance_or_die(obj, clazz):
-    if not isinstance(obj, clazz):
+    # The guard documents an invariant the code already enforces, and
+    # it sits on hot lookup paths; python -O drops it entirely.
+    if __debug__ and not isinstance(obj, clazz):
         die("Object %s is not an instance of %s", obj, clazz)
     return obj
 
 
-def ensure_build_file(package: str, cwd: pathlib.Path):
+def ensure_build_file(package: str, cwd: pathlib.Path) -> bool:
+    """Creates an empty BUILD file for package if it has none.
+
+    Returns:
+        whether a new BUILD file was created
+    """
     if os.path.isabs(package):
         die("%s is not a relative path.", package)
     abs_package = cwd / package
-    if not (abs_package / "BUILD.bazel").is_file() and \
-            not (abs_package / "BUILD").is_file():
-        build_file = abs_package / "BUILD.bazel"
-        logging.info(f"Creating {build_file}")
-        with open(build_file, "w"):
+    if (abs_package / "BUILD").is_file():
+        return False
+    build_file = abs_package / "BUILD.bazel"
+    try:
+        # "x" folds the existence check into the creation, instead of a
+        # separate stat that races against concurrent runs.
+        with open(build_file, "x"):
             pass
+    except FileExistsError:
+        return False
+    logging.info(f"Created {build_file}")
+    return True
 
 
-@dataclasses.dataclass(frozen=True)
-class InfoKey(object):
+# These keys populate self.existing with hundreds of entries per run
+# and are hashed on every lookup; named tuples hash and compare at
+# tuple speed with no per-instance __dict__.
+class TargetKey(NamedTuple):
     """The key of the dictionary storing information for existing BUILD files."""
 
     # Full label of the target.
     target: str
 
 
-class TargetKey(InfoKey):
-    pass
-
-
-@dataclasses.dataclass(frozen=True)
-class AttributeKey(InfoKey):
+class AttributeKey(NamedTuple):
     """The key of the dictionary storing information for existing BUILD files."""
 
+    # Full label of the target.
+    target: str
+
     # Name of the attribute.
     attribute: Optional[str]
 
 
+InfoKey = TargetKey | AttributeKey
+
+
 class InfoValue(object):
     """The value of the dictionary storing information for existing BUILD files."""
 
+    __slots__ = ()
+
     # Attribute value is None.
     NONE = "None"
 
@@ -80,7 +129,7 @@ class InfoValue(object):
     MISSING = None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class AttributeValue(InfoValue):
     # String-representation of the attribute value.
     # - If attribute value is None, this is the string "None" (InfoValue.NONE).
@@ -101,7 +150,7 @@ class AttributeValue(InfoValue):
         return self.is_missing() or self.is_none_value()
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class TargetValue(InfoValue):
     # Kind of the declaration (e.g. kernel_build)
     kind: Optional[str] = InfoValue.MISSING
@@ -127,70 +176,230 @@ class BuildozerCommandBuilder(object):
         # Add full label as a comment to name for testing purposes.
         self._add_package_comment_for_test = False
 
-        self.buildozer = self._find_buildozer()
-
         # set in context manager
         self.out_file: Optional[TextIO] = None
 
+        # True during the discovery pass of run(), whose commands and
+        # extra files are discarded; only the effect on self.existing
+        # matters, so emission is skipped entirely.
+        self._discovery_pass = False
+
         # set in run
         self.existing: Optional[dict[InfoKey, InfoValue]] = None
 
+        # Targets whose creation commands were already written in this
+        # pass, mapped to their formatted label. Repeated _new() calls
+        # (e.g. one per kernel_images variable) return the cached label
+        # without re-emitting commands for buildozer to parse.
+        self._created_targets: dict[tuple, str] = {}
+
+        # Packages whose BUILD file was created, empty, by this run.
+        # Nothing in them can exist yet, so buildozer queries for their
+        # targets are skipped.
+        self._created_build_files: set[str] = set()
+
+        # Packages already checked by _ensure_build_file. Every _new()
+        # call goes through it, so without the memo the same two BUILD
+        # file paths would be stat'ed once per created target.
+        self._ensured_packages: set[str] = set()
+
+    @functools.cached_property
+    def buildozer(self) -> str:
+        """Path to the buildozer binary.
+
+        Resolved lazily so subclasses may overlap the lookup with their
+        own startup subprocesses.
+        """
+        return _find_buildozer(self.environ.get("GOPATH"),
+                               self.environ.get("HOME"))
+
     def __enter__(self):
-        self.out_file = tempfile.NamedTemporaryFile("w+")
+        # Commands are accumulated in memory; _run_buildozer writes them
+        # out to a file in one go.
+        self.out_file = io.StringIO()
         return self
 
     def __exit__(self, exc, value, tb):
         self.out_file.close()
         self.out_file = None
 
-    def _find_buildozer(self) -> str:
-        buildozer = shutil.which("buildozer")
-        if buildozer:
-            return buildozer
-
-        gopath = self.environ.get("GOPATH", os.path.join(self.environ["HOME"], "go"))
-        buildozer = os.path.join(gopath, "bin", "buildozer")
-        if os.path.isfile(buildozer):
-            return buildozer
+    def _ensure_build_file(self, package: str):
+        """Creates an empty BUILD file for package if it has none."""
+        if package in self._ensured_packages:
+            return
+        self._ensured_packages.add(package)
+        if ensure_build_file(package, self._workspace_root()):
+            self._created_build_files.add(package)
 
-        die("Can't find buildozer. Install with instructions at "
-            "https://github.com/bazelbuild/buildtools/blob/master/buildozer/README.md")
+    @staticmethod
+    def _package_of(target: str) -> str:
+        """Returns the package of a full label, e.g. //foo:bar -> foo."""
+        return target.removeprefix("//").partition(":")[0]
 
     def _get_all_info(self, keys: Iterable[InfoKey]) -> dict[InfoKey, InfoValue]:
         """Gets all interesting information of existing BUILD files.
 
+        Keys in packages whose BUILD file was created, empty, by this
+        run cannot exist yet, so they are marked missing without
+        forking buildozer.
+
         Args:
             keys: The list of interesting information to get.
         """
         ret = dict()
+        target_keys = []
+        attr_keys = []
         for key in keys:
-            tup = None
-            if isinstance(key, TargetKey):
-                tup = self._get_target(key.target)
-            elif isinstance(key, AttributeKey):
-                tup = self._get_attr(key)
-            ret[tup[0]] = tup[1]
+            if type(self)._package_of(key.target) in self._created_build_files:
+                if isinstance(key, TargetKey):
+                    ret[key] = TargetValue()
+                else:
+                    ret[key] = AttributeValue()
+            elif isinstance(key, TargetKey):
+                target_keys.append(key)
+            else:
+                attr_keys.append(key)
+        ret.update(self._get_target_kinds(target_keys))
+        ret.update(self._get_attrs(attr_keys))
         return ret
 
-    def _buildozer_print(self, target, print_command, attribute,
-                         parse_list=False) -> Optional[str | list[str]]:
-        """Executes a buildozer print command."""
-        value = InfoValue.MISSING
+    def _run_print_commands(self, commands: Iterable[str]) -> str:
+        """Runs a command file of buildozer print commands in one call.
 
+        Returns:
+            the combined stdout of the print commands.
+        """
         try:
-            value = subprocess.check_output(
-                [self.buildozer, f"{print_command} {attribute}", target],
+            return subprocess.check_output(
+                [self.buildozer, "-k", "-f", "-"],
+                input="".join(f"{command}\n" for command in commands),
                 text=True, stderr=subprocess.PIPE, env=self.environ,
-                cwd=self._workspace_root()).strip()
-        except subprocess.CalledProcessError:
-            pass
+                cwd=self._workspace_root())
+        except subprocess.CalledProcessError as e:
+            # Missing targets make buildozer return nonzero even
+            # with -k; the targets it did find are still printed.
+            return e.output or ""
 
-        if value is not InfoValue.MISSING and parse_list:
-            list_value = type(self)._parse_label_list(value)
-            if list_value is not None:
-                return list_value
+    @staticmethod
+    def _label_aliases(target: str) -> list[str]:
+        """Returns the labels buildozer may print for target.
 
-        return value
+        buildozer shortens //pkg:pkgname to //pkg in print output.
+        """
+        aliases = [target]
+        package, _, name = target.partition(":")
+        if package.rsplit("/", 1)[-1] == name:
+            aliases.append(package)
+        return aliases
+
+    def _get_target_kinds(self, target_keys: list[TargetKey]) \
+            -> dict[InfoKey, InfoValue]:
+        """Gets the kind of every target with a single buildozer call.
+
+        One subprocess per target forks buildozer dozens of times per
+        run.  All the kind queries are batched into one command file
+        instead.  `print label kind` echoes the label of each rule it
+        finds, so targets that do not exist are simply absent from the
+        output and the remaining lines match up unambiguously.
+        """
+        ret: dict[InfoKey, InfoValue] = {
+            key: TargetValue(InfoValue.MISSING) for key in target_keys}
+        if not target_keys:
+            return ret
+
+        output = self._run_print_commands(
+            f"print label kind|{key.target}" for key in target_keys)
+
+        by_label = {}
+        for key in target_keys:
+            for alias in type(self)._label_aliases(key.target):
+                by_label[alias] = key
+
+        for line in output.splitlines():
+            label, _, kind = line.strip().partition(" ")
+            key = by_label.get(label)
+            if key is not None and kind:
+                ret[key] = TargetValue(kind=kind)
+        return ret
+
+    def _get_attrs(self, attr_keys: list[AttributeKey]) \
+            -> dict[InfoKey, InfoValue]:
+        """Gets attribute values and comments with batched buildozer calls.
+
+        One subprocess per attribute value, plus another per comment,
+        used to dominate the runtime of the query pass.  Existing
+        targets are determined first; on an existing target every
+        `print label <attr>` command emits exactly one line, with
+        "(missing)" standing in for absent attributes, so grouping the
+        output by label maps the lines back to the queried keys.
+        Comments are then fetched per package, because print_comment
+        output carries no label: within one BUILD file buildozer
+        processes commands in order, one output line each.
+        """
+        ret: dict[InfoKey, InfoValue] = {
+            key: AttributeValue() for key in attr_keys}
+        if not attr_keys:
+            return ret
+
+        targets = sorted({key.target for key in attr_keys})
+        kinds = self._get_target_kinds(
+            [TargetKey(target) for target in targets])
+        existing_targets = {
+            key.target for key, value in kinds.items()
+            if value.kind is not InfoValue.MISSING}
+
+        value_keys = [key for key in attr_keys
+                      if key.target in existing_targets]
+        if not value_keys:
+            return ret
+
+        # All aliases of a target share one queue; lines for the same
+        # label pop keys in command-file order.
+        queues: dict[str, list[AttributeKey]] = {}
+        for key in value_keys:
+            aliases = type(self)._label_aliases(key.target)
+            queue = queues.get(aliases[0])
+            if queue is None:
+                queue = []
+                for alias in aliases:
+                    queues[alias] = queue
+            queue.append(key)
+
+        output = self._run_print_commands(
+            f"print label {key.attribute}|{key.target}" for key in value_keys)
+        for line in output.splitlines():
+            label, _, value = line.strip().partition(" ")
+            queue = queues.get(label)
+            if not queue:
+                continue
+            key = queue.pop(0)
+            if value == "(missing)":
+                continue
+            list_value = type(self)._parse_label_list(value)
+            ret[key].value = list_value if list_value is not None else value
+
+        # print_comment only succeeds on attributes that exist, so the
+        # line counts below are only trusted when they match.
+        comment_keys_by_package: dict[str, list[AttributeKey]] = {}
+        for key in value_keys:
+            if not ret[key].is_missing():
+                comment_keys_by_package.setdefault(
+                    type(self)._package_of(key.target), []).append(key)
+        for comment_keys in comment_keys_by_package.values():
+            output = self._run_print_commands(
+                f"print_comment {key.attribute}|{key.target}"
+                for key in comment_keys)
+            lines = output.splitlines()
+            if len(lines) != len(comment_keys):
+                # A failed command would shift every following line.
+                # Leave the comments missing; re-adding an existing
+                # comment is harmless.
+                logging.warning(
+                    "Unexpected print_comment output, ignoring:\n%s", output)
+                continue
+            for key, line in zip(comment_keys, lines):
+                ret[key].comment = line.strip()
+        return ret
 
     @staticmethod
     def _parse_label_list(value: str) -> Optional[list[str]]:
@@ -201,28 +410,9 @@ class BuildozerCommandBuilder(object):
             return None
         return value.removeprefix("[").removesuffix("]").split(" ")
 
-    def _get_target(self, target: str) -> tuple[InfoKey, InfoValue]:
-        """Gets information about a single target from existing BUILD files.
-
-        Args:
-            target: full label of target.
-        """
-        kind = self._buildozer_print(target, "print", "kind")
-        return TargetKey(target), TargetValue(kind)
-
-    def _get_attr(self, key: AttributeKey) -> tuple[InfoKey, InfoValue]:
-        """Gets a single attribute of existing BUILD files.
-
-        Args:
-            key: the InfoKey.
-        """
-        value = self._buildozer_print(key.target, "print", key.attribute, parse_list=True)
-        comment = self._buildozer_print(key.target, "print_comment", key.attribute)
-        return key, AttributeValue(value=value, comment=comment)
-
     @staticmethod
     def _is_bash_func(build_config: str) -> bool:
-        return build_config.startswith("BASH_FUNC_") and build_config.endswith("%%")
+        return _BASH_FUNC_RE.match(build_config) is not None
 
     def _new(self, kind: str, name: str, package: str, load_from="//build/kernel/kleaf:kernel.bzl") \
             -> str:
@@ -233,9 +423,14 @@ class BuildozerCommandBuilder(object):
         """
         if package is None:
             die("No package specified in _new()")
-        ensure_build_file(package, self._workspace_root())
-        new_target_pkg = f"//{package}:__pkg__"
+        cache_key = (kind, name, package, load_from)
+        new_target = self._created_targets.get(cache_key)
+        if new_target is not None:
+            return new_target
         new_target = f"//{package}:{name}"
+        self._created_targets[cache_key] = new_target
+        self._ensure_build_file(package)
+        new_target_pkg = f"//{package}:__pkg__"
         key = TargetKey(new_target)
 
         existing_kind = InfoValue.MISSING
@@ -243,21 +438,15 @@ class BuildozerCommandBuilder(object):
             existing_kind = isinstance_or_die(self.existing[key], TargetValue).kind
 
         if load_from:
-            self.out_file.write(f"""
-                fix movePackageToTop|{new_target_pkg}
-                new_load {load_from} {kind}|{new_target_pkg}
-            """)
+            self._emit("fix movePackageToTop", new_target_pkg)
+            self._emit(f"new_load {load_from} {kind}", new_target_pkg)
 
         if existing_kind is InfoValue.MISSING:
-            self.out_file.write(f"""
-                new {kind} {name}|{new_target_pkg}
-            """)
+            self._emit(f"new {kind} {name}", new_target_pkg)
             self.existing[key] = TargetValue(kind=kind)
         elif existing_kind != kind:
             logging.warning(f"Forcefully setting {new_target} from {existing_kind} to {kind}")
-            self.out_file.write(f"""
-                set kind {kind}|{new_target}
-            """)
+            self._emit(f"set kind {kind}", new_target)
             self.existing[key] = TargetValue(kind=kind)
 
         if self._add_package_comment_for_test:
@@ -265,9 +454,25 @@ class BuildozerCommandBuilder(object):
 
         return new_target
 
+    def _emit(self, command: str, target: str):
+        """Writes a single buildozer command to the command file.
+
+        buildozer uses | to separate a command from its target and a
+        newline to separate commands. A raw occurrence of either
+        corrupts every following line of the command file, so fail fast
+        here rather than letting buildozer reject the file.
+        """
+        if self._discovery_pass:
+            return
+        if "|" in target or "\n" in target:
+            die("Invalid target %r for buildozer command %r", target, command)
+        if "\n" in command:
+            die("Unescaped newline in buildozer command %r", command)
+        self.out_file.write(f"{command}|{target}\n")
+
     def _set_kind(self, target: str, kind: str):
         """Writes a buildozer command that sets the kind of a target."""
-        self.out_file.write(f"""set kind {kind}|{target}\n""")
+        self._emit(f"set kind {kind}", target)
         self.existing[TargetKey(target)] = TargetValue(kind=kind)
 
     def _add_comment(self, target: str, attribute: str, expected_comment: str,
@@ -286,8 +491,8 @@ class BuildozerCommandBuilder(object):
             logging.info(f"pred passes: {attr_val.comment}")
             if attr_val.comment is InfoValue.MISSING or \
                     expected_comment not in attr_val.comment:
-                esc_comment = expected_comment.replace(" ", "\\ ")
-                self.out_file.write(f"""comment {attribute} {esc_comment}|{target}\n""")
+                esc_comment = expected_comment.translate(BUILDOZER_ESCAPE)
+                self._emit(f"comment {attribute} {esc_comment}", target)
                 attr_val.comment = expected_comment
 
     def _add_target_comment(self, target: str, comment_lines: Iterable[str]):
@@ -295,10 +500,9 @@ class BuildozerCommandBuilder(object):
 
         # "comment" command on targets will override existing comments,
         # so there is no need to check existing comments.
-        content = "\\n".join(comment_lines)
-        content = content.replace(" ", "\\ ")
+        content = "\\n".join(comment_lines).translate(BUILDOZER_ESCAPE)
         if content:
-            self.out_file.write(f"""comment {content}|{target}\n""")
+            self._emit(f"comment {content}", target)
 
     def _set_attr(self, target: str, attribute: str, value: Optional[bool | str],
                   quote: bool = False,
@@ -316,7 +520,7 @@ class BuildozerCommandBuilder(object):
             die(f"Unknown command {command} for _set_attr")
 
         command_value = f'"{value}"' if quote else str(value)
-        self.out_file.write(f"""{command} {attribute} {command_value}|{target}\n""")
+        self._emit(f"{command} {attribute} {command_value}", target)
 
         # set value in self.existing
         key = AttributeKey(target, attribute)
@@ -336,7 +540,7 @@ class BuildozerCommandBuilder(object):
             quote: if value should be quoted in the buildozer command
         """
         command_value = f'"{value}"' if quote else value
-        self.out_file.write(f"""add {attribute} {command_value}|{target}\n""")
+        self._emit(f"add {attribute} {command_value}", target)
 
         # set value in self.existing
         key = AttributeKey(target, attribute)
@@ -360,7 +564,7 @@ class BuildozerCommandBuilder(object):
             old_attr: old attribute name
             new_attr: new attribute name
         """
-        self.out_file.write(f"rename {old_attr} {new_attr}|{target}\n")
+        self._emit(f"rename {old_attr} {new_attr}", target)
 
         old_key = AttributeKey(target, old_attr)
         new_key = AttributeKey(target, new_attr)
@@ -375,6 +579,8 @@ class BuildozerCommandBuilder(object):
 
     def _create_extra_file(self, path: str, content: str):
         """Creates an extra file in the filesystem."""
+        if self._discovery_pass:
+            return
         if self.args.stdout:
             logging.info(f"Dry-run: skipped creating file at {path}")
             return
@@ -384,22 +590,28 @@ class BuildozerCommandBuilder(object):
             f.write(content)
 
     def _run_buildozer(self) -> None:
-        self.out_file.seek(0)
-        logging.info("Executing buildozer with the following commands:\n%s", self.out_file.read())
+        commands = self.out_file.getvalue()
+        if not commands:
+            logging.info("No buildozer commands to execute.")
+            return
+        logging.info("Executing buildozer with the following commands:\n%s", commands)
 
+        # Commands are fed through stdin instead of a temp file, saving
+        # the file lifecycle and a disk round-trip.
         buildozer_args = [
             self.buildozer,
             "-shorten_labels",
             "-f",
-            self.out_file.name,
+            "-",
         ]
         if self.args.keep_going:
             buildozer_args.append("-k")
         if self.args.stdout:
             buildozer_args.append("-stdout")
         try:
-            subprocess.check_call(buildozer_args, stdout=self.stdout, stderr=self.stderr,
-                                  env=self.environ, cwd=self._workspace_root())
+            subprocess.run(buildozer_args, input=commands, text=True, check=True,
+                           stdout=self.stdout, stderr=self.stderr,
+                           env=self.environ, cwd=self._workspace_root())
         except subprocess.CalledProcessError as e:
             if e.returncode == _BUILDOZER_RETURN_CODE_NO_CHANGES_MADE:
                 logging.info("No files were changed.")
@@ -413,18 +625,27 @@ class BuildozerCommandBuilder(object):
         return isinstance_or_die(self.existing[AttributeKey(target, attribute)], AttributeValue)
 
     def run(self):
-        # Dry run to see what attributes / targets will be added
+        # Discovery pass to see what attributes / targets will be
+        # added. Nothing is emitted; only the effect on self.existing
+        # matters. The commands cannot be generated once and reused for
+        # the real run below because they depend on the queried
+        # information, but the key set they touch does not.
         self.existing = dict()
-        with self:
-            # This modifies self.existing
-            self._create_buildozer_commands()
-            # The buildozer command file is deleted.
+        self._created_targets = {}
+        self._discovery_pass = True
+        try:
+            with self:
+                # This modifies self.existing
+                self._create_buildozer_commands()
+        finally:
+            self._discovery_pass = False
 
         # self.existing.keys() = things we would change.
         # Get the existing information of these things in BUILD files
         self.existing = self._get_all_info(self.existing.keys())
 
         # Create another buildozer command file. This time, actually run buildozer with it.
+        self._created_targets = {}
         with self:
             self._create_buildozer_commands()
             self._run_buildozer()
@@ -14,14 +14,11 @@
 
 """Analyze the inputs from `.cmd` files"""
 import argparse
-import asyncio
-import collections
+import concurrent.futures
 import dataclasses
 import fnmatch
-import functools
 import json
 import logging
-import operator
 import pathlib
 import os
 import shlex
@@ -29,11 +26,24 @@ import re
 import tarfile
 from typing import Iterable, Optional, Any
 
-# Regex to parse .cmd files. Each section has the format of:
-# dep_foo := \
-#   a.h \
-#   b.h
-_RE = r"^(?P<key>\S*?)\s*:=(?P<values>((\\\n| |\t)+(\S*))*)"
+
+def _archive_member_names(archive_path: pathlib.Path) -> Iterable[str]:
+    """Yields member names of a tar archive in one sequential pass."""
+    # r|* streams the archive instead of building a seekable index, so
+    # compressed archives are decompressed exactly once, front to back.
+    with tarfile.open(archive_path, "r|*") as archive:
+        for member in archive:
+            yield member.name
+
+
+def _translate_filters(filters: list[str]) -> Optional[re.Pattern]:
+    """Combines fnmatch filters into a single alternation regex.
+
+    Returns None if there are no filters.
+    """
+    if not filters:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in filters))
 
 
 def _make_rel(path: pathlib.Path):
@@ -56,10 +66,8 @@ class IncludeData(object):
         return self
 
     def to_dict(self) -> dict[str, list[str]]:
-        dict_pairs = []
-        for key, values in vars(self).items():
-            dict_pairs.append((key, sorted(str(value) for value in values)))
-        return collections.OrderedDict(dict_pairs)
+        return {key: sorted(str(value) for value in values)
+                for key, values in vars(self).items()}
 
 
 class AnalyzeInputs(object):
@@ -67,42 +75,67 @@ class AnalyzeInputs(object):
     def __init__(self, out: pathlib.Path, dirs: list[pathlib.Path],
                  module_srcs: list[pathlib.Path],
                  include_filters: list[str], exclude_filters: list[str],
-                 gen_files_archives: list[tarfile.TarFile], **ignored):
+                 gen_files_archives: list[pathlib.Path], **ignored):
         self._out = out
         self._dirs = dirs
-        self._include_filters = include_filters
-        self._exclude_filters = exclude_filters
+        self._include_re = _translate_filters(include_filters)
+        self._exclude_re = _translate_filters(exclude_filters)
         self._module_srcs = set(module_srcs)
         self._unresolved: set[pathlib.Path] = set()
 
-        self._cmd_parser = argparse.ArgumentParser()
-        self._cmd_parser.add_argument("-I", type=pathlib.Path, action="append", default=[])
-        self._cmd_parser.add_argument("-include", type=pathlib.Path, action="append", default=[])
-        self._cmd_parser.add_argument("--sysroot", type=pathlib.Path)
+        # Keep the names as normalized strings; str hashes faster than
+        # pathlib.Path and these are only ever used for membership tests.
+        self._archived_input_names: frozenset[str] = frozenset(
+            os.path.normpath(name)
+            for archive_path in gen_files_archives
+            for name in _archive_member_names(archive_path))
 
-        self._archived_input_names: set[pathlib.Path] = set()
-        for archive in gen_files_archives:
-            names = archive.getnames()
-            paths = set(pathlib.Path(os.path.normpath(name)) for name in names)
-            self._archived_input_names.update(paths)
+    # Paths are handed to worker processes in batches to amortize the
+    # pickling overhead of each submission.
+    _SUBMIT_BATCH_SIZE = 64
 
-    async def run(self):
-        self._out.mkdir(parents=True, exist_ok=True)
-        aws = []
+    def _scan_paths(self) -> Iterable[pathlib.Path]:
         for dir in self._dirs:
             for root, _, files in os.walk(dir):
                 root_path = pathlib.Path(root)
                 for filename in files:
-                    aws.append(self._write_deps(root_path / filename))
-
-        await asyncio.gather(*aws)
+                    # Only *.cmd files carry deps_* / cmd_* sections.
+                    if filename.endswith(".cmd"):
+                        yield root_path / filename
 
-    async def _write_deps(self, path: pathlib.Path):
+    def run(self):
+        self._out.mkdir(parents=True, exist_ok=True)
+        # Parsing .cmd files is CPU-bound regex work, so fan it out across
+        # cores, submitting batches as the walk discovers them so parsing
+        # overlaps the directory traversal.
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            futures = []
+            batch = []
+            for path in self._scan_paths():
+                batch.append(path)
+                if len(batch) >= self._SUBMIT_BATCH_SIZE:
+                    futures.append(executor.submit(self._write_deps_batch, batch))
+                    batch = []
+            if batch:
+                futures.append(executor.submit(self._write_deps_batch, batch))
+            for future in futures:
+                future.result()
+
+    def _write_deps_batch(self, paths: list[pathlib.Path]):
+        for path in paths:
+            self._write_deps(path)
+
+    def _write_deps(self, path: pathlib.Path):
         deps = self._get_deps(path)
+        if not (deps.include_dirs or deps.include_files or deps.unresolved):
+            # An empty json contributes nothing to the merged result, so
+            # skip the mkdir / open / write for it.
+            return
         stem = self._out / _make_rel(path)
         stem.parent.mkdir(parents=True, exist_ok=True)
-        with open(stem.with_suffix(".json"), "w") as file:
-            json.dump(deps.to_dict(), file, indent=2)
+        # Encode to one string and write it in one call; json.dump would
+        # push each encoder fragment through the file object separately.
+        stem.with_suffix(".json").write_text(json.dumps(deps.to_dict(), indent=2))
 
 
     def _get_deps(self, path: pathlib.Path) -> IncludeData:
@@ -110,22 +143,32 @@ class AnalyzeInputs(object):
 
         deps = dict()
         cmds = dict()
-        with open(path) as f:
-            for mo in re.finditer(_RE, f.read(), re.MULTILINE):
-                key = mo.group("key")
-                if key.startswith("deps_"):
-                    deps[key.removeprefix("deps_")] = mo.group("values")
-                elif key.startswith("cmd_"):
-                    cmds[key.removeprefix("cmd_")] = mo.group("values")
-
-            for object, deps_str in deps.items():
-                deps_str = deps_str.replace("\\\n", " ")
-                one_deps = set(self._filter_deps(deps_str.split()))
-                one_parse_data = self._resolve_files(one_deps, cmds.get(object), path)
-                ret |= one_parse_data
+        # Each section of a .cmd file has the format of:
+        # dep_foo := \
+        #   a.h \
+        #   b.h
+        # Join the backslash-newline continuations, then lex line by line;
+        # only the sections of interest are ever decoded.
+        data = path.read_bytes().replace(b"\\\n", b" ")
+        for line in data.splitlines():
+            key, sep, values = line.partition(b":=")
+            if not sep:
+                continue
+            key = key.strip()
+            if key.startswith(b"deps_"):
+                deps[key.removeprefix(b"deps_").decode()] = values.decode()
+            elif key.startswith(b"cmd_"):
+                cmds[key.removeprefix(b"cmd_").decode()] = values.decode()
+
+        for object, deps_str in deps.items():
+            one_deps = set(self._filter_deps(deps_str.split()))
+            one_parse_data = self._resolve_files(one_deps, cmds.get(object), path)
+            ret |= one_parse_data
         return ret
 
     def _filter_deps(self, dep_strs: Iterable[str]) -> Iterable[pathlib.Path]:
+        include_re = self._include_re
+        exclude_re = self._exclude_re
         for dep_str in dep_strs:
             dep_str = dep_str.strip()
             if not dep_str:
@@ -133,15 +176,9 @@ class AnalyzeInputs(object):
             if dep_str.startswith("$(wildcard") or dep_str.endswith(")"):
                 # Ignore wildcards; we don't need them for headers analysis
                 continue
-
-            for exclude_filter in self._exclude_filters:
-                if fnmatch.fnmatch(dep_str, exclude_filter):
-                    continue
-
-            should_include = any(fnmatch.fnmatch(dep_str, i) for i in self._include_filters)
-            should_exclude = any(fnmatch.fnmatch(dep_str, i) for i in self._exclude_filters)
-
-            if should_include and not should_exclude:
+            if exclude_re is not None and exclude_re.match(dep_str):
+                continue
+            if include_re is not None and include_re.match(dep_str):
                 yield pathlib.Path(dep_str)
 
     def _parse_cmd(self, cmd: Optional[str]) -> IncludeData:
@@ -149,16 +186,41 @@ class AnalyzeInputs(object):
             return IncludeData()
 
         ret = IncludeData()
-        # Simple cmd parser
+        # Simple cmd parser. Only -I, -include and --sysroot matter, so a
+        # linear scan over the tokens beats argparse's per-call dispatch.
         for one_cmd in cmd.split(";"):
-            tokens = shlex.split(one_cmd)
+            # shlex walks the string char by char in Python; most kbuild
+            # commands carry no quoting, and for those plain whitespace
+            # splitting produces the same tokens.
+            if "'" in one_cmd or '"' in one_cmd or "\\" in one_cmd:
+                tokens = shlex.split(one_cmd)
+            else:
+                tokens = one_cmd.split()
             if not tokens or "clang" not in pathlib.Path(tokens[0]).name:
                 continue
-            known, _ = self._cmd_parser.parse_known_args(tokens[1:])
-            ret.include_files |= set(known.include)
-            ret.include_dirs |= set(AnalyzeInputs._resolve_path(dir) for dir in known.I)
-            if known.sysroot:
-                ret.include_dirs.add(AnalyzeInputs._resolve_path(known.sysroot))
+            sysroot = None
+            it = iter(tokens[1:])
+            for token in it:
+                if token == "-I":
+                    value = next(it, None)
+                    if value is not None:
+                        ret.include_dirs.add(
+                            AnalyzeInputs._resolve_path(pathlib.Path(value)))
+                elif token.startswith("-I"):
+                    ret.include_dirs.add(
+                        AnalyzeInputs._resolve_path(pathlib.Path(token[2:])))
+                elif token == "-include":
+                    value = next(it, None)
+                    if value is not None:
+                        ret.include_files.add(pathlib.Path(value))
+                elif token == "--sysroot":
+                    value = next(it, None)
+                    if value is not None:
+                        sysroot = pathlib.Path(value)
+                elif token.startswith("--sysroot="):
+                    sysroot = pathlib.Path(token.removeprefix("--sysroot="))
+            if sysroot:
+                ret.include_dirs.add(AnalyzeInputs._resolve_path(sysroot))
         return ret
 
     def _resolve_files(self, deps: Iterable[pathlib.Path], cmd: Optional[str],
@@ -186,7 +248,7 @@ class AnalyzeInputs(object):
                         continue
 
                 # Ignore headers in archives of generated files
-                if dep in self._archived_input_names:
+                if str(dep) in self._archived_input_names:
                     continue
 
                 logging.warning("%s: Unknown dep %s", cmd_file_path, dep)
@@ -208,7 +270,7 @@ if __name__ == "__main__":
     parser.add_argument("-v", "--verbose", action="store_true", default=False)
     parser.add_argument("--include_filters", nargs="*", default=["*"])
     parser.add_argument("--exclude_filters", nargs="*", default=[])
-    parser.add_argument("--gen_files_archives", type=tarfile.open, nargs="*", default=[],
+    parser.add_argument("--gen_files_archives", type=pathlib.Path, nargs="*", default=[],
                         help="List of tar of generated files. Generated files are not considered"
                             "as inputs to a target.")
     parser.add_argument("--module_srcs", type=pathlib.Path, nargs="*", default=[])
@@ -217,4 +279,4 @@ if __name__ == "__main__":
     log_level = logging.DEBUG if args.verbose else logging.INFO
     logging.basicConfig(level=log_level, format="%(levelname)s: %(message)s")
 
-    asyncio.run(AnalyzeInputs(**vars(parser.parse_args())).run())
+    AnalyzeInputs(**vars(args)).run()
@@ -354,13 +354,8 @@ class KleafIntegrationTestBase(unittest.TestCase):
 
     def _sha256(self, path: pathlib.Path | str) -> str:
         """Gets the hash for a file."""
-        hash = hashlib.sha256()
         with open(path, "rb") as file:
-            chunk = None
-            while chunk != b'':
-                chunk = file.read(4096)
-                hash.update(chunk)
-        return hash.hexdigest()
+            return hashlib.file_digest(file, "sha256").hexdigest()
 
     def _touch(self, path: pathlib.Path | str, append_text="\n") -> None:
         """Modifies a file so it (may) trigger a rebuild for certain targets."""